@@ -1,40 +1,92 @@
 #!/usr/bin/python
 
 import argparse
-import coinex_api
+import atexit
+import cProfile
+import collections
 try:
     import configparser
 except ImportError:
     # Python 2.7 compatbility
     import ConfigParser
     configparser = ConfigParser
-import cryptsy_api
 import exchange_api
+import exchange_registry
+import functools
+import itertools
+import log_pipeline
+import metrics
+import multiprocessing
+import order_pipeline
 import os
+import poll_scheduler
+import sell_routes
+import sell_signals
+import shared_market_data
 import sys
+import threading
+import tick_log
 import time
+import traceback
 
 def _FormatFloat(number):
     return ('%.8f' % number).rstrip('0').rstrip('.')
 
+_log_pipeline = log_pipeline.LogPipeline()
+atexit.register(_log_pipeline.Flush)
+
 def _Log(message, *args):
-    print('%s: %s' % (time.strftime('%c'), message % args))
+    _log_pipeline.Log(message, *args)
+
+# Cycles started early by pushed market data start at least this many seconds after the last one,
+# so that a busy stream doesn't use up the request budget on balance checks.
+_MIN_PUSHED_CYCLE_DELAY = 1
+
+# The stages of a polling cycle that --profile reports the time of, in order. Order book fetches
+# and order creation happen on the order pipeline's threads, in parallel with the others.
+_PROFILE_STAGES = ('balances', 'market_lookup', 'evaluate', 'order_book', 'create_order', 'sleep')
+
+# How long, in seconds, worker processes wait for the supervisor to publish an exchange's markets.
+_MARKET_DATA_TIMEOUT = 300
 
-def _LoadExchangeConfig(config, target_currencies, source_currencies, exchange_class, *keys):
-    if not config.has_section(exchange_class.GetName()):
+# Reads the config file at 'path', exiting if it can't be read.
+def _ReadConfig(path):
+    config = configparser.RawConfigParser()
+    try:
+        path = os.path.expanduser(path)
+        _Log('Using config from "%s".', path)
+        with open(path) as config_file:
+            config.readfp(config_file)
+    except IOError as e:
+        _Log('Failed to read config: %s', e)
+        sys.exit(1)
+    return config
+
+# Creates the exchange called 'name' from its section in 'config', if there is one. The exchange's
+# module is only imported then. 'exchange_args' are passed on to the exchange's constructor.
+def _LoadExchangeConfig(config, target_currencies, source_currencies, snapshot_dir, name,
+                        **exchange_args):
+    if not config.has_section(name):
         return None
+    exchange_class = exchange_registry.GetExchangeClass(name)
 
-    args = {}
-    for key in keys:
-        if not config.has_option(exchange_class.GetName(), key):
-            _Log('Missing %s.%s.', exchange_class.GetName(), key)
+    args = dict(exchange_args)
+    for key in exchange_class.GetConfigKeys():
+        if not config.has_option(name, key):
+            _Log('Missing %s.%s.', name, key)
             return None
-        args[key] = config.get(exchange_class.GetName(), key)
+        args[key] = config.get(name, key)
+    if config.has_option(name, 'api_url'):
+        args['api_url'] = config.get(name, 'api_url')
+    stream_url = (config.get(name, 'stream_url') if
+                  config.has_option(name, 'stream_url') else None)
+    if snapshot_dir:
+        args['snapshot_path'] = os.path.join(snapshot_dir, name + '.snapshot')
 
     try:
         exchange = exchange_class(**args)
     except exchange_api.ExchangeException as e:
-        _Log('Failed to create %s instance: %s', exchange_class.GetName(), e)
+        _Log('Failed to create %s instance: %s', name, e)
         return None
 
     currencies = set(exchange.GetCurrencies())
@@ -45,26 +97,351 @@ def _LoadExchangeConfig(config, target_currencies, source_currencies, exchange_c
         _Log('%s does not list any source_currencies, disabling.', exchange.GetName())
         return None
     else:
-        _Log('Monitoring %s.', exchange_class.GetName())
+        _Log('Monitoring %s.', name)
+        if stream_url:
+            exchange.Subscribe(exchange_api.JSONLinesStream(stream_url))
         return exchange
 
+# Calls each function in 'loaders' on its own thread, so that exchanges, whose constructors make
+# requests, are created in parallel. Returns the results in order.
+def _LoadInParallel(loaders):
+    results = [None] * len(loaders)
+    errors = []
+    def Load(index):
+        try:
+            results[index] = loaders[index]()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=Load, args=(index,)) for index in range(len(loaders))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+# Evaluates the exchange's balances and submits sells for those that trigger. Returns the set of
+# markets the balances may be sold into.
+def _SellBalances(exchange, scheduler, tracker, routes, pipeline, near_trigger_margin):
+    try:
+        with metrics.Timer(metrics.STAGE_SECONDS, (exchange.GetName(), 'balances')):
+            balances = exchange.GetBalances()
+    except exchange_api.ExchangeException as e:
+        _Log('Failed to get %s balances: %s', exchange.GetName(), e)
+        metrics.FAILURES.Increment((exchange.GetName(), 'balances', metrics.GetErrorType(e)))
+        return set()
+
+    # Collect the (market, balance) pairs that are due and whose balance or prices changed since
+    # they were last evaluated, each currency's in target priority order.
+    now = time.time()
+    seen_markets = set()
+    candidates = []
+    states = []
+    with metrics.Timer(metrics.STAGE_SECONDS, (exchange.GetName(), 'market_lookup')):
+        routes.Sync(exchange)
+        for (currency, balance) in balances.items():
+            for market in routes.GetRoutes(currency):
+                seen_markets.add(market)
+                if not scheduler.IsDue(market, now):
+                    continue
+                state = tracker.GetState(market, balance)
+                if not tracker.HasChanged(market, state):
+                    scheduler.Reschedule(market, now, tracker.WasNearTrigger(market))
+                    continue
+
+                if verbose:
+                    _log_pipeline.LogSampled(
+                        (exchange, currency, market.GetTargetCurrency()),
+                        "Looking at %s to %s market on %s, day's max = %s.",
+                        currency, market.GetTargetCurrency(), exchange.GetName(),
+                        market.GetDayMaxPrice())
+                candidates.append((market, balance))
+                states.append(state)
+        scheduler.Prune(seen_markets)
+        tracker.Prune(seen_markets)
+
+    sell_markets = collections.OrderedDict()
+    with metrics.Timer(metrics.STAGE_SECONDS, (exchange.GetName(), 'evaluate')):
+        (sells, nears) = sell_signals.Evaluate(candidates, near_trigger_margin)
+        for ((market, balance), state, sell, near) in zip(candidates, states, sells, nears):
+            scheduler.Reschedule(market, now, near)
+            if not sell:
+                # Sells are retried until the balance changes, so only unsold markets are clean.
+                tracker.MarkClean(market, state, near)
+                continue
+            sell_markets.setdefault(market.GetSourceCurrency(), ([], balance))[0].append(market)
+
+    for (markets, balance) in sell_markets.values():
+        pipeline.Submit(markets, balance)
+    return seen_markets
+
+# Logs the outcome of a sell attempt made by an OrderPipeline for 'account', if running many.
+def _ReportSell(result, account=None):
+    market = result.market
+    exchange_name = market.GetExchange().GetName()
+    if account is not None:
+        exchange_name = '%s (%s)' % (exchange_name, account)
+    currency = market.GetSourceCurrency()
+    target_currency = market.GetTargetCurrency()
+    if result.order is not None:
+        _Log('Created sell order %s for %s %s at %s %s on %s.',
+             result.order.GetOrderId(), _FormatFloat(result.amount), currency,
+             _FormatFloat(result.price), target_currency, exchange_name)
+        metrics.ORDERS.Increment((exchange_name,))
+    elif result.stage == 'no_bids':
+        _Log('No buy orders for %s/%s on %s.', currency, target_currency, exchange_name)
+    elif result.stage == 'error':
+        _Log('Failed to sell %s %s on %s: %r', _FormatFloat(result.amount), currency,
+             exchange_name, result.error)
+        metrics.FAILURES.Increment((exchange_name, 'sell', metrics.GetErrorType(result.error)))
+    elif result.stage == 'order_book':
+        _Log('Failed to get public orders for %s/%s on %s: %s',
+             currency, target_currency, exchange_name, result.error)
+        metrics.FAILURES.Increment((exchange_name, 'order_book',
+                                    metrics.GetErrorType(result.error)))
+    else:
+        _Log('Failed to create sell order for %s %s at %s %s on %s: %s',
+             _FormatFloat(result.amount), currency, _FormatFloat(result.price),
+             target_currency, exchange_name, result.error)
+        metrics.FAILURES.Increment((exchange_name, 'create_order',
+                                    metrics.GetErrorType(result.error)))
+
+# Logs how long the stages of an exchange's 'cycles' profiled polling cycles took, out of
+# 'wall_time' seconds in total, and where the profile was written to, if anywhere.
+def _ReportProfile(exchange, cycles, wall_time, profile_path):
+    if profile_path is not None:
+        _Log('Profiled %d %s cycles in %.3fs, stats written to "%s":', cycles,
+             exchange.GetName(), wall_time, profile_path)
+    else:
+        _Log('Profiled %d %s cycles in %.3fs, stats in the other exchange\'s profile:', cycles,
+             exchange.GetName(), wall_time)
+    for stage in _PROFILE_STAGES:
+        (count, total) = metrics.STAGE_SECONDS.GetTotals((exchange.GetName(), stage))
+        _Log('  %-14s %9.3fs %6.1f%% %6d times', stage, total,
+             100 * total / wall_time if wall_time else 0, count)
+
+# Polls a single exchange forever, or for 'profile_cycles' cycles under cProfile. Each exchange
+# runs this on its own thread, with its own scheduler and request rate limit.
+def _PollExchange(exchange, target_currencies, source_currencies, poll_delay, fast_poll_delay,
+                  near_trigger_margin, max_orders_in_flight, account=None, profile_cycles=None):
+    scheduler = poll_scheduler.PollScheduler(poll_delay, fast_poll_delay)
+    tracker = poll_scheduler.ChangeTracker()
+    routes = sell_routes.RouteIndex(target_currencies, source_currencies)
+    pipeline = order_pipeline.OrderPipeline(max_orders_in_flight,
+                                            lambda result: _ReportSell(result, account))
+    if profile_cycles:
+        # Only this thread is profiled; the order pipeline's stages show in the report.
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ runs one profiler at a time, which profiles all threads.
+            profile = None
+        start_time = time.time()
+    for cycle in itertools.count(1):
+        try:
+            with metrics.Timer(metrics.CYCLE_SECONDS, (exchange.GetName(),)):
+                held_markets = _SellBalances(exchange, scheduler, tracker, routes, pipeline,
+                                             near_trigger_margin)
+        except Exception as e:
+            # A bug, or a malformed response that slipped past the exchange's checks. Keep
+            # polling this exchange rather than letting its thread die quietly.
+            _Log('Unexpected error polling %s:\n%s', exchange.GetName(),
+                 traceback.format_exc().rstrip())
+            metrics.FAILURES.Increment((exchange.GetName(), 'cycle', metrics.GetErrorType(e)))
+            held_markets = set()
+        if cycle == profile_cycles:
+            break
+        now = time.time()
+        next_cycle = now + max(fast_poll_delay, scheduler.GetNextDue(now) - now)
+        with metrics.Timer(metrics.STAGE_SECONDS, (exchange.GetName(), 'sleep')):
+            # Start the next cycle early if market data is pushed for a market we hold a
+            # balance for.
+            time.sleep(min(_MIN_PUSHED_CYCLE_DELAY, next_cycle - now))
+            while time.time() < next_cycle:
+                updated_markets = (exchange.WaitForMarketUpdates(next_cycle - time.time()) &
+                                   held_markets)
+                if updated_markets:
+                    for market in updated_markets:
+                        scheduler.MarkDue(market)
+                    break
+
+    pipeline.Join()
+    profile_path = None
+    if profile is not None:
+        profile.disable()
+        profile_path = '%s.%s.prof' % (profile_prefix, exchange.GetName())
+        profile.dump_stats(profile_path)
+    _ReportProfile(exchange, profile_cycles, time.time() - start_time, profile_path)
+
+# Applies the [General] settings to a newly created exchange. Only one exchange instance per
+# exchange may 'record_ticks'.
+def _ConfigureExchange(exchange, record_ticks=True):
+    exchange.GetOrderBookCache().SetTTL(order_book_ttl)
+    exchange.SetCurrencyFilter(source_currencies, target_currencies)
+    exchange.SetMarketRefreshDelay(market_refresh_delay)
+    exchange.SetRequestTimeout(request_timeout)
+    exchange.SetHedgeDelay(hedge_delay)
+    exchange.GetCircuitBreaker().SetFailureThreshold(circuit_failure_threshold)
+    rate_limiter = exchange.GetRateLimiter()
+    if request_rate is not None:
+        rate_limiter.SetRate(request_rate)
+    if request_delay > 0:
+        rate = rate_limiter.GetRate()
+        rate_limiter.SetRate(min(rate, 1.0 / request_delay) if rate else 1.0 / request_delay, 1)
+    if tick_log_dir and record_ticks and exchange.RecordsTicks():
+        try:
+            exchange.SetTickRecorder(tick_log.TickRecorder(
+                os.path.join(tick_log_dir, exchange.GetName() + '.ticks')))
+        except IOError as e:
+            _Log('Not recording %s ticks: %s', exchange.GetName(), e)
+
+# Starts polling 'exchange' on its own thread, so a slow exchange doesn't hold up the others.
+# With 'profile_cycles', the thread exits after profiling that many cycles.
+def _StartPolling(exchange, account=None, profile_cycles=None):
+    thread = threading.Thread(target=_PollExchange,
+                              name=exchange.GetName() if account is None else
+                              '%s/%s' % (account, exchange.GetName()),
+                              args=(exchange, target_currencies, source_currencies,
+                                    poll_delay, fast_poll_delay, near_trigger_margin,
+                                    max_orders_in_flight, account, profile_cycles))
+    thread.daemon = True
+    thread.start()
+    return thread
+
+# Waits until all 'workers', threads or processes, exited.
+def _WaitForAll(workers):
+    # Sleep rather than join() so that KeyboardInterrupt still reaches the main thread.
+    while any(worker.is_alive() for worker in workers):
+        time.sleep(1)
+
+# Waits while the worker 'processes' run, each polling the accounts of its shard in 'shards'.
+# Workers poll forever, so once one exits its accounts are no longer polled: this logs which and
+# exits with an error, for whatever runs the script to restart it. Workers aren't restarted here,
+# since forking now would copy the supervisor's threads' locks in whatever state they're in.
+def _WatchWorkers(processes, shards):
+    while True:
+        for (process, shard) in zip(processes, shards):
+            if not process.is_alive():
+                _Log('Worker %s exited with code %s, accounts %s are no longer polled. Exiting.',
+                     process.name, process.exitcode,
+                     ', '.join(account for (account, _) in shard))
+                sys.exit(1)
+        time.sleep(1)
+
+# Runs in each worker process of multi-account mode: polls the exchanges of 'accounts', a list
+# of (name, config) tuples, using the public market data the supervisor publishes to
+# 'market_datas', a dict of exchange name to SharedMarketData.
+def _RunWorker(accounts, market_datas):
+    shared_market_data.ExitWithParent()
+    loaders = []
+    for (account, account_config) in accounts:
+        for name in exchange_registry.GetNames():
+            market_data = market_datas.get(name)
+            if market_data is not None and account_config.has_section(name):
+                loaders.append((account, functools.partial(
+                    _LoadFollower, account, account_config, name, market_data)))
+    exchanges = _LoadInParallel([loader for (_, loader) in loaders])
+
+    threads = []
+    for ((account, _), exchange) in zip(loaders, exchanges):
+        if exchange is not None:
+            _ConfigureExchange(exchange, record_ticks=False)
+            threads.append(_StartPolling(exchange, account))
+    _WaitForAll(threads)
+
+# Creates the exchange called 'name' of 'account' in a worker process, following the public
+# 'market_data' the supervisor publishes for it. Returns None if that fails.
+def _LoadFollower(account, account_config, name, market_data):
+    if not market_data.WaitForMarkets(_MARKET_DATA_TIMEOUT):
+        _Log('No %s market data for %s, disabling.', name, account)
+        return None
+    return _LoadExchangeConfig(account_config, target_currencies, source_currencies, None, name,
+                               market_data=market_data)
+
+# Runs multi-account mode. The supervisor (this process) fetches each exchange's public market
+# data once, with the keys of the first account configured for it, and shares it with 'workers'
+# worker processes that poll the accounts at 'account_paths' and only make their own private
+# requests. The worker polling that first account shares the supervisor's request nonces.
+def _RunSupervisor(account_paths, workers):
+    accounts = [(os.path.basename(path), _ReadConfig(path)) for path in account_paths]
+    # Worker processes are forked, so that they inherit the shared memory and the accounts.
+    context = multiprocessing.get_context('fork')
+    manager = shared_market_data.StartManager(context)
+    market_datas = {}
+    publisher_configs = {}
+    for name in exchange_registry.GetNames():
+        account_config = next((account_config for (_, account_config) in accounts if
+                               account_config.has_section(name)), None)
+        if account_config is None:
+            continue
+        # The publisher shares its nonces with the worker polling the same account.
+        config_keys = exchange_registry.GetExchangeClass(name).GetConfigKeys()
+        publisher_keys = [account_config.get(name, key) if account_config.has_option(name, key)
+                          else None for key in config_keys]
+        market_datas[name] = shared_market_data.SharedMarketData(context, manager,
+                                                                 max_shared_markets,
+                                                                 publisher_keys)
+        publisher_configs[name] = account_config
+
+    # Fork before starting any threads, so no worker inherits a lock held by one.
+    processes = []
+    shards = [accounts[index::workers] for index in range(workers)]
+    for (index, shard) in enumerate(shards):
+        process = context.Process(target=_RunWorker, name='worker-%d' % index,
+                                  args=(shard, market_datas))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    _Log('Running %d accounts in %d worker processes.', len(accounts), workers)
+
+    names = list(market_datas.keys())
+    loaders = []
+    for name in names:
+        loaders.append(functools.partial(
+            _LoadExchangeConfig, publisher_configs[name], target_currencies, source_currencies,
+            snapshot_dir, name, market_data=market_datas[name], publish_market_data=True))
+    for (name, exchange) in zip(names, _LoadInParallel(loaders)):
+        if exchange is None:
+            market_datas[name].SetFailed()
+        else:
+            _ConfigureExchange(exchange)
+
+    if metrics_port:
+        metrics.StartServer(metrics_port)
+        _Log('Serving metrics on http://127.0.0.1:%d/metrics.', metrics_port)
+    _WatchWorkers(processes, shards)
+
 verbose = True
 
 parser = argparse.ArgumentParser(description='Script to auto-sell altcoins.')
 parser.add_argument('-c', '--config', dest='config_path', default='~/.altcoin-autosell.config',
                     help='path to the configuration file')
-parser.add_argument('-v', '--verbose', dest='verbose', action='store_const', const=True default=True)
+parser.add_argument('-v', '--verbose', dest='verbose', action='store_const', const=True, default=True)
+parser.add_argument('-a', '--account', dest='account_paths', action='append', default=[],
+                    help='path to an account configuration file with exchange sections; repeat '
+                    'to run many accounts in worker processes, with [General] from --config')
+parser.add_argument('-w', '--workers', dest='workers', type=int, default=None,
+                    help='number of worker processes for --account, by default one per CPU')
+parser.add_argument('--profile', dest='profile_cycles', type=int, default=None,
+                    help='profile this many polling cycles of each exchange with cProfile, '
+                    'report how long each stage took and exit')
+parser.add_argument('--profile-prefix', dest='profile_prefix', default='altcoin-autosell',
+                    help='--profile writes the stats of each exchange to '
+                    '<prefix>.<exchange>.prof')
 args = parser.parse_args()
+profile_prefix = args.profile_prefix
 
-config = configparser.RawConfigParser()
-try:
-    config_path = os.path.expanduser(args.config_path)
-    _Log('Using config from "%s".', config_path)
-    with open(config_path) as config_file:
-        config.readfp(config_file)
-except IOError as e:
-    _Log('Failed to read config: %s', e)
-    sys.exit(1)
+config = _ReadConfig(args.config_path)
+if config.has_option('General', 'log_format'):
+    log_format = config.get('General', 'log_format').strip()
+    if log_format not in ('text', 'json'):
+        _Log('Unknown log_format "%s", expected text or json.', log_format)
+        sys.exit(1)
+    _log_pipeline.SetJSONLines(log_format == 'json')
+if config.has_option('General', 'verbose_log_interval'):
+    _log_pipeline.SetSampleInterval(config.getfloat('General', 'verbose_log_interval'))
 target_currencies = ([target_currency.strip() for target_currency in
                       config.get('General', 'target_currencies').split(',')] if
                      config.has_option('General', 'target_currencies') else ['BTC', 'LTC'])
@@ -76,82 +453,60 @@ if source_currencies:
     _Log('Selling from %s.', source_currencies)
 poll_delay = (config.getint('General', 'poll_delay') if
               config.has_option('General', 'poll_delay') else 60)
-request_delay = (config.getint('General', 'request_delay') if
-                 config.has_option('General', 'request_delay') else 1)
+fast_poll_delay = min(poll_delay, config.getfloat('General', 'fast_poll_delay') if
+                      config.has_option('General', 'fast_poll_delay') else 10)
+near_trigger_margin = (config.getfloat('General', 'near_trigger_margin') if
+                       config.has_option('General', 'near_trigger_margin') else 0.05)
+request_delay = (config.getfloat('General', 'request_delay') if
+                 config.has_option('General', 'request_delay') else 0)
+request_rate = (config.getfloat('General', 'request_rate') if
+                config.has_option('General', 'request_rate') else None)
+request_timeout = (config.getfloat('General', 'request_timeout') if
+                   config.has_option('General', 'request_timeout') else 15)
+hedge_delay = (config.getfloat('General', 'hedge_delay') if
+               config.has_option('General', 'hedge_delay') else 2)
+circuit_failure_threshold = (config.getint('General', 'circuit_failure_threshold') if
+                             config.has_option('General', 'circuit_failure_threshold') else 5)
+market_refresh_delay = (config.getfloat('General', 'market_refresh_delay') if
+                        config.has_option('General', 'market_refresh_delay') else 5)
+max_orders_in_flight = (config.getint('General', 'max_orders_in_flight') if
+                        config.has_option('General', 'max_orders_in_flight') else 4)
+metrics_port = (config.getint('General', 'metrics_port') if
+                config.has_option('General', 'metrics_port') else None)
+snapshot_dir = (os.path.expanduser(config.get('General', 'snapshot_dir')) if
+                config.has_option('General', 'snapshot_dir') else None)
+if snapshot_dir and not os.path.isdir(snapshot_dir):
+    os.makedirs(snapshot_dir)
+order_book_ttl = (config.getfloat('General', 'order_book_ttl') if
+                  config.has_option('General', 'order_book_ttl') else 2)
+tick_log_dir = (os.path.expanduser(config.get('General', 'tick_log_dir')) if
+                config.has_option('General', 'tick_log_dir') else None)
+if tick_log_dir and not os.path.isdir(tick_log_dir):
+    os.makedirs(tick_log_dir)
+max_shared_markets = (config.getint('General', 'max_shared_markets') if
+                      config.has_option('General', 'max_shared_markets') else 4096)
 
-exchanges = [_LoadExchangeConfig(config, target_currencies, source_currencies,
-                                 coinex_api.CoinEx, 'api_key', 'api_secret'),
-             _LoadExchangeConfig(config, target_currencies, source_currencies,
-                                 cryptsy_api.Cryptsy, 'api_private_key', 'api_public_key')]
+if args.account_paths:
+    if args.profile_cycles:
+        _Log('--profile does not support --account.')
+        sys.exit(1)
+    _RunSupervisor(args.account_paths,
+                   args.workers or min(len(args.account_paths), multiprocessing.cpu_count()))
+    sys.exit(0)
+
+exchanges = _LoadInParallel([functools.partial(_LoadExchangeConfig, config, target_currencies,
+                                                source_currencies, snapshot_dir, name) for
+                              name in exchange_registry.GetNames()])
 exchanges = [exchange for exchange in exchanges if exchange is not None]
 if not exchanges:
     _Log('No exchange sections defined!')
     sys.exit(1)
+for exchange in exchanges:
+    _ConfigureExchange(exchange)
 
-while True:
-    for exchange in exchanges:
-        try:
-            balances = exchange.GetBalances()
-        except exchange_api.ExchangeException as e:
-            _Log('Failed to get %s balances: %s', exchange.GetName(), e)
-            continue
-
-        markets = exchange.GetMarkets()
-        for (currency, balance) in balances.items():
-            if (currency not in markets or
-                (source_currencies and currency not in source_currencies)):
-                continue
-            currency_markets = markets[currency]
-
-            for target_currency in target_currencies:
-                if (not currency or
-                    target_currency not in currency_markets or
-                    (currency in target_currencies and
-                     (target_currencies.index(target_currency) >=
-                      target_currencies.index(currency)))):
-                    continue
-                market = currency_markets[target_currency]
+if metrics_port:
+    metrics.StartServer(metrics_port)
+    _Log('Serving metrics on http://127.0.0.1:%d/metrics.', metrics_port)
 
-                if verbose:
-                    _Log("Looking at %s to %s market.",source_currency,target_currency)
-                    _Log("Day's max = %s",market.GetDayMaxPrice())
-                
-                sell = False
-
-                if balance < market.GetTradeMinimum() and market.GetPrices()[0] > 0:
-                    if market.GetPrices()[0] > market.GetDayMaxPrice()*.93:
-                        if market.GetPrices()[0] == market.GetPrices()[1] and market.GetPrices()[1] == market.GetPrices()[2] and market.GetPrices()[2] == market.GetPrices()[3] and market.GetPrices()[3] == market.GetPrices()[4] and market.GetPrices()[4] == market.GetPrices()[5]:
-                                sell = True
-                    elif market.GetPrices()[0] <= market.GetPrices()[1]:
-                            sell = True
-                
-                if sell:
-                #    currency = None  # don't try other markets
-                #    continue
-
-                    try:
-                        orders = [order.GetPrice() for order in market.GetPublicOrders()[0]]
-                        if not orders:
-                            _Log('No buy orders for %s/%s on %s.',
-                                 currency, target_currency, exchange.GetName())
-                            continue
-                        sell_price = max(orders)
-                    except exchange_api.ExchangeException as e:
-                        _Log('Failed to get public orders for %s/%s on %s: %s',
-                             currency, target_currency, exchange.GetName(), e)
-                        continue
-
-                    try:
-                        time.sleep(request_delay)
-                        order = market.CreateOrder(False, balance, sell_price)
-                        _Log('Created sell order %s for %s %s at %s %s on %s.',
-                             order.GetOrderId(), _FormatFloat(balance), currency,
-                             _FormatFloat(sell_price), target_currency, exchange.GetName())
-                    except exchange_api.ExchangeException as e:
-                        _Log('Failed to create sell order for %s %s at %s %s on %s: %s',
-                             _FormatFloat(balance), currency, _FormatFloat(sell_price),
-                             target_currency, exchange.GetName(), e)
-                    finally:
-                        currency = None  # don't try other markets
-
-    time.sleep(poll_delay)
+_WaitForAll([_StartPolling(exchange, profile_cycles=args.profile_cycles) for
+             exchange in exchanges])
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+# Replays a tick log recorded with [General] tick_log_dir (see tick_log.py) through the sell
+# strategy against simulated markets, much faster than real time, and reports the fills and
+# proceeds each strategy setting would have got.
+#
+# The replay uses the same routing (sell_routes) and sell check (sell_signals) as the script:
+# after every recorded price refresh, every balance is evaluated and sold at the market's last
+# recorded best bid (or its last trade price, if no order book was recorded).
+
+import argparse
+import collections
+import exchange_api
+import itertools
+import sell_routes
+import sell_signals
+import tick_log
+import time
+
+class SimulatedMarket(exchange_api.Market):
+    __slots__ = ('_source_currency', '_target_currency', '_price_slot', '_best_bid')
+
+    def __init__(self, exchange, source_currency, target_currency, price_slot):
+        exchange_api.Market.__init__(self, exchange)
+        self._source_currency = source_currency
+        self._target_currency = target_currency
+        self._price_slot = price_slot
+        self._best_bid = None
+
+    def GetSourceCurrency(self):
+        return self._source_currency
+
+    def GetTargetCurrency(self):
+        return self._target_currency
+
+    def GetTradeMinimum(self):
+        return self._exchange._trade_minimum
+
+    def GetPriceSlot(self):
+        return self._price_slot
+
+    def GetPriceVersion(self):
+        return self._exchange._prices.GetVersion(self._price_slot)
+
+    def GetPrices(self):
+        return self._exchange._prices.GetPrices(self._price_slot)
+
+    def GetDayMaxPrice(self):
+        return self._exchange._prices.GetDayMaxPrice(self._price_slot)
+
+    def GetPriceTick(self):
+        return self._exchange._prices.GetTick(self._price_slot)
+
+    def GetBestBid(self):
+        if self._best_bid is not None:
+            return self._best_bid
+        last_price = self.GetPrices()[0]
+        return last_price if last_price > 0 else None
+
+    def CreateOrder(self, bid_order, amount, price):
+        return self._exchange._Fill(self, amount, price)
+
+# An exchange whose markets are fed from a tick log and whose orders fill immediately.
+class SimulatedExchange(exchange_api.Exchange):
+    @staticmethod
+    def GetName():
+        return 'Backtest'
+
+    def __init__(self, balances, trade_minimum, depth):
+        exchange_api.Exchange.__init__(self)
+        self._balances = dict(balances)
+        self._trade_minimum = trade_minimum
+        self._prices = exchange_api.PriceStore(depth=depth)
+        self._order_ids = itertools.count(1)
+        self.time = 0
+        self.fills = []
+
+    # Adds both directions of the market from 'source_currency' to 'target_currency'.
+    def _AddMarket(self, source_currency, target_currency):
+        self._markets = self._markets.Add(
+            SimulatedMarket(self, source, target, self._prices.AddSlot()) for
+            (source, target) in ((source_currency, target_currency),
+                                 (target_currency, source_currency)) if
+            not self._markets.HasMarket(source, target))
+
+    def _AddPrice(self, source_currency, target_currency, last_trade, day_max_price):
+        self._prices.AddTicks((
+            (self._markets[source_currency][target_currency]._price_slot, last_trade,
+             day_max_price),
+            (self._markets[target_currency][source_currency]._price_slot,
+             1 / last_trade if last_trade > 0 else 0,
+             1 / day_max_price if day_max_price > 0 else 0)))
+
+    def _Fill(self, market, amount, price):
+        self._balances[market.GetSourceCurrency()] -= amount
+        self.fills.append((self.time, market.GetSourceCurrency(), market.GetTargetCurrency(),
+                           amount, price))
+        return exchange_api.Order(market, next(self._order_ids), False, amount, price, self.time)
+
+    def GetCurrencies(self):
+        return self._markets.keys()
+
+    def GetBalances(self):
+        return {currency : balance for currency, balance in self._balances.items() if
+                balance > 0}
+
+    def GetPriceStore(self):
+        return self._prices
+
+# Evaluates every balance of 'exchange' and sells those the strategy triggers on.
+def _SellBalances(exchange, routes, day_max_ratio, flat_ticks):
+    routes.Sync(exchange)
+    candidates = []
+    for (currency, balance) in exchange.GetBalances().items():
+        for market in routes.GetRoutes(currency):
+            candidates.append((market, balance))
+    (sells, _) = sell_signals.Evaluate(candidates, 0, day_max_ratio, flat_ticks)
+
+    sold_currencies = set()
+    for ((market, balance), sell) in zip(candidates, sells):
+        currency = market.GetSourceCurrency()
+        if not sell or currency in sold_currencies:
+            continue
+        price = market.GetBestBid()
+        if price is None:
+            continue
+        market.CreateOrder(False, balance, price)
+        sold_currencies.add(currency)
+
+# Replays the ticks of 'reader', a tick_log.TickLogReader, starting with 'balance' of every
+# source currency. Returns the SimulatedExchange, whose 'fills' lists the (time, source
+# currency, target currency, amount, price) of every sell.
+def Replay(reader, target_currencies, source_currencies, balance, trade_minimum,
+           day_max_ratio=sell_signals.DAY_MAX_RATIO, flat_ticks=sell_signals.FLAT_TICKS):
+    market_currencies = {key : (source_currency, target_currency) for
+                         (key, source_currency, target_currency) in reader.IterMarkets()}
+    currencies = set(itertools.chain.from_iterable(market_currencies.values()))
+    balances = {currency : balance for currency in currencies if
+                (currency in source_currencies if source_currencies else
+                 currency not in target_currencies)}
+    exchange = SimulatedExchange(balances, trade_minimum, max(flat_ticks, 2))
+    for (source_currency, target_currency) in market_currencies.values():
+        exchange._AddMarket(source_currency, target_currency)
+    routes = sell_routes.RouteIndex(target_currencies, source_currencies)
+
+    # Price ticks with the same timestamp come from one refresh; evaluate once it's complete.
+    refresh_time = None
+    for (kind, key, timestamp, value1, value2) in reader.IterTicks():
+        (source_currency, target_currency) = market_currencies[key]
+        if kind == 'order_book':
+            exchange.GetMarkets()[source_currency][target_currency]._best_bid = value1
+            continue
+        if timestamp != refresh_time:
+            if refresh_time is not None:
+                _SellBalances(exchange, routes, day_max_ratio, flat_ticks)
+            refresh_time = exchange.time = timestamp
+        exchange._AddPrice(source_currency, target_currency, value1, value2)
+    if refresh_time is not None:
+        _SellBalances(exchange, routes, day_max_ratio, flat_ticks)
+    return exchange
+
+def _ParseList(value, parse=str):
+    return [parse(item.strip()) for item in value.split(',') if item.strip()]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backtest the sell strategy on a tick log.')
+    parser.add_argument('tick_log', help='path to a tick log written by altcoin-autosell.py')
+    parser.add_argument('--target-currencies', dest='target_currencies', default='BTC, LTC',
+                        help='comma-separated list of currencies to convert to')
+    parser.add_argument('--source-currencies', dest='source_currencies', default='',
+                        help='comma-separated list of currencies to convert from')
+    parser.add_argument('--balance', type=float, default=1,
+                        help='starting balance of every source currency')
+    # The live sell check only sells balances below the market's trade minimum. By default
+    # the minimum is above any balance, so that only the price rules decide.
+    parser.add_argument('--trade-minimum', dest='trade_minimum', type=float,
+                        default=float('inf'), help='trade minimum of every market')
+    parser.add_argument('--day-max-ratio', dest='day_max_ratios',
+                        default=str(sell_signals.DAY_MAX_RATIO),
+                        help='comma-separated day max ratios to compare')
+    parser.add_argument('--flat-ticks', dest='flat_ticks', default=str(sell_signals.FLAT_TICKS),
+                        help='comma-separated flat price tick counts to compare')
+    args = parser.parse_args()
+
+    reader = tick_log.TickLogReader(args.tick_log)
+    target_currencies = _ParseList(args.target_currencies)
+    source_currencies = _ParseList(args.source_currencies)
+    for (day_max_ratio, flat_ticks) in itertools.product(_ParseList(args.day_max_ratios, float),
+                                                         _ParseList(args.flat_ticks, int)):
+        start_time = time.time()
+        exchange = Replay(reader, target_currencies, source_currencies, args.balance,
+                          args.trade_minimum, day_max_ratio, flat_ticks)
+        elapsed = time.time() - start_time
+
+        proceeds = collections.defaultdict(float)
+        for (_, _, target_currency, amount, price) in exchange.fills:
+            proceeds[target_currency] += amount * price
+        print('day_max_ratio=%s flat_ticks=%d: %d fills, proceeds %s (replayed in %.2fs)' %
+              (day_max_ratio, flat_ticks, len(exchange.fills),
+               ', '.join('%.8f %s' % (total, currency) for
+                         currency, total in sorted(proceeds.items())) or 'none',
+               elapsed))
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+# Runs altcoin-autosell.py against the local mock exchanges in mock_exchanges.py and reports how
+# long each polling cycle took, how many requests each cycle made and how much memory the
+# process used.
+#
+# Cycles are counted from the mock servers' point of view: every cycle starts with one balance
+# request, so a cycle is the time and the requests between two consecutive balance requests.
+
+import argparse
+import collections
+import mock_exchanges
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+_BALANCE_METHODS = {'CoinEx' : 'balances', 'Cryptsy' : 'getinfo'}
+_ORDER_METHODS = {'CoinEx' : 'create_order', 'Cryptsy' : 'createorder'}
+
+def _Percentile(values, percentile):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(percentile / 100.0 * (len(values) - 1))))]
+
+# Returns the peak resident set size of process 'pid' in kB, or None if unavailable.
+def _GetPeakMemory(pid):
+    try:
+        with open('/proc/%d/status' % pid) as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+def _WriteConfig(config_file, coinex, cryptsy, stream, args):
+    config_file.write('[General]\n'
+                      'target_currencies = BTC\n'
+                      'poll_delay = %d\n'
+                      'request_delay = %d\n'
+                      'request_rate = %g\n' % (args.poll_delay, args.request_delay,
+                                                args.request_rate))
+    if coinex:
+        config_file.write('[CoinEx]\n'
+                          'api_key = benchmark\n'
+                          'api_secret = benchmark\n'
+                          'api_url = %s\n' % coinex.GetApiUrl())
+    if cryptsy:
+        config_file.write('[Cryptsy]\n'
+                          'api_public_key = benchmark\n'
+                          'api_private_key = benchmark\n'
+                          'api_url = %s\n' % cryptsy.GetApiUrl())
+        if stream:
+            config_file.write('stream_url = %s\n' % stream.GetStreamUrl())
+    config_file.flush()
+
+def _Report(name, request_log, poll_delay):
+    requests = request_log.GetRequests()
+    cycle_starts = [index for index, (_, method) in enumerate(requests) if
+                    method == _BALANCE_METHODS[name]]
+    cycles = list(zip(cycle_starts, cycle_starts[1:]))
+    latencies = [requests[end][0] - requests[start][0] - poll_delay for start, end in cycles]
+    method_counts = collections.Counter(method for _, method in requests)
+
+    print('%s:' % name)
+    print('  cycles: %d' % len(cycles))
+    print('  cycle latency (s): p50 %.4f  p90 %.4f  p99 %.4f  max %.4f' %
+          (_Percentile(latencies, 50), _Percentile(latencies, 90), _Percentile(latencies, 99),
+           max(latencies) if latencies else float('nan')))
+    if cycles:
+        print('  requests per cycle: %.2f' % ((cycles[-1][1] - cycles[0][0]) / float(len(cycles))))
+    print('  requests by method: %s' %
+          ', '.join('%s=%d' % item for item in sorted(method_counts.items())))
+    print('  orders created: %d' % method_counts[_ORDER_METHODS[name]])
+    order_times = [request_time for (request_time, method) in requests if
+                   method == _ORDER_METHODS[name]]
+    if order_times:
+        print('  first order after (s): %.2f' % (order_times[0] - requests[0][0]))
+
+parser = argparse.ArgumentParser(description='Benchmark altcoin-autosell.py cycles against '
+                                             'local mock exchanges.')
+parser.add_argument('--exchanges', default='CoinEx,Cryptsy',
+                    help='comma-separated list of exchanges to mock')
+parser.add_argument('--markets', type=int, default=50, help='number of altcoin markets')
+parser.add_argument('--latency', type=float, default=0.01,
+                    help='seconds of latency added to every mock response')
+parser.add_argument('--duration', type=float, default=30, help='seconds to run for')
+parser.add_argument('--poll-delay', dest='poll_delay', type=int, default=0,
+                    help='poll_delay passed to altcoin-autosell.py')
+parser.add_argument('--request-delay', dest='request_delay', type=int, default=0,
+                    help='request_delay passed to altcoin-autosell.py')
+parser.add_argument('--request-rate', dest='request_rate', type=float, default=0,
+                    help='request_rate passed to altcoin-autosell.py; 0, the default, disables '
+                    'rate limiting')
+parser.add_argument('--stream', action='store_true',
+                    help='push Cryptsy market data from a mock stream instead of only polling')
+parser.add_argument('--log', default=os.devnull, help='file to write the script\'s output to')
+args = parser.parse_args()
+
+exchange_names = [name.strip() for name in args.exchanges.split(',')]
+coinex = (mock_exchanges.MockCoinEx(args.markets, args.latency) if
+          'CoinEx' in exchange_names else None)
+cryptsy = (mock_exchanges.MockCryptsy(args.markets, args.latency) if
+           'Cryptsy' in exchange_names else None)
+stream = mock_exchanges.MockStream(args.markets) if cryptsy and args.stream else None
+mocks = [(name, mock) for name, mock in (('CoinEx', coinex), ('Cryptsy', cryptsy)) if mock]
+if not mocks:
+    print('No known exchanges in --exchanges.')
+    sys.exit(1)
+for _, mock in mocks:
+    mock.Start()
+if stream:
+    stream.Start()
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'altcoin-autosell.py')
+with tempfile.NamedTemporaryFile('w', suffix='.config') as config_file:
+    with open(args.log, 'w') as log:
+        _WriteConfig(config_file, coinex, cryptsy, stream, args)
+        process = subprocess.Popen([sys.executable, script, '-c', config_file.name],
+                                   stdout=log, stderr=subprocess.STDOUT)
+        peak_memory = None
+        deadline = time.time() + args.duration
+        while time.time() < deadline and process.poll() is None:
+            peak_memory = _GetPeakMemory(process.pid) or peak_memory
+            time.sleep(0.1)
+        if process.poll() is not None:
+            print('altcoin-autosell.py exited early with status %d.' % process.returncode)
+        else:
+            process.terminate()
+        process.wait()
+
+if stream:
+    stream.Stop()
+for name, mock in mocks:
+    mock.Stop()
+    _Report(name, mock.request_log, args.poll_delay)
+if peak_memory is not None:
+    print('peak memory: %d kB' % peak_memory)
@@ -1,22 +1,24 @@
-import collections
 import exchange_api
 import hashlib
 import hmac
 import json
+import threading
+import time
+import transport
 try:
-    import http.client
-    import urllib.request
-    import urllib.error
     import urllib.parse
 except ImportError:
     # Python 2.7 compatbility
-    import httplib
-    class http: client = httplib
     import urllib
-    import urllib2
-    class urllib: request = urllib2; error = urllib2; parse = urllib
+    class urllib: parse = urllib
+
+# Market list loads, which go ahead of balance checks and orders.
+_PRIORITY_METHODS = frozenset(['currencies', 'trade_pairs'])
 
 class Market(exchange_api.Market):
+    __slots__ = ('_source_currency_id', '_source_currency', '_target_currency_id',
+                 '_target_currency', '_trade_pair_id', '_reverse_market')
+
     def __init__(self, exchange, source_currency_id, target_currency_id, trade_pair_id,
                  reverse_market):
         exchange_api.Market.__init__(self, exchange)
@@ -36,21 +38,26 @@ class Market(exchange_api.Market):
     def GetTradeMinimum(self):
         return 0.01
 
-    def GetPublicOrders(self):
+    def _FetchOrderBook(self):
+        orders = self._exchange._Request('orders', request_vars={'tradePair' : self._trade_pair_id})
         try:
-            request_vars = {'tradePair' : self._trade_pair_id}
-            orders = self._exchange._Request('orders', request_vars=request_vars)
-            return ([exchange_api.Order(self, order['id'], True,
-                                        float(order['amount']) / pow(10, 8),
-                                        float(order['rate']) / pow(10, 8)) for
-                     order in orders if order['bid']],
-                    [exchange_api.Order(self, order['id'], False,
-                                        float(order['amount']) / pow(10, 8),
-                                        float(order['rate']) / pow(10, 8)) for
-                     order in orders if not order['bid']])
-        except (TypeError, LookupError) as e:
+            bids = [order for order in orders if order['bid']]
+            asks = [order for order in orders if not order['bid']]
+            return exchange_api.OrderBook(
+                [float(order['rate']) / pow(10, 8) for order in bids],
+                [float(order['amount']) / pow(10, 8) for order in bids],
+                [float(order['rate']) / pow(10, 8) for order in asks],
+                [float(order['amount']) / pow(10, 8) for order in asks],
+                [order['id'] for order in bids], [order['id'] for order in asks])
+        except (TypeError, LookupError, ValueError) as e:
             raise exchange_api.ExchangeException(e)
 
+    def _GetOrderBookKey(self):
+        return self._trade_pair_id
+
+    def GetOrderBook(self):
+        return self._exchange.GetOrderBookCache().Get(self._trade_pair_id, self._FetchOrderBook)
+
     def CreateOrder(self, bid_order, amount, price):
         if self._reverse_market:
             bid_order = not bid_order
@@ -61,62 +68,119 @@ class Market(exchange_api.Market):
         post_data = json.dumps({'order' : order}).encode('utf-8')
         try:
             order_id = self._exchange._PrivateRequest('orders', post_data, 'order')['id']
+            self._exchange.GetOrderBookCache().Invalidate(self._trade_pair_id)
             return exchange_api.Order(self, order_id, bid_order, amount, price)
         except (TypeError, LookupError) as e:
             raise exchange_api.ExchangeException(e)
 
 class CoinEx(exchange_api.Exchange):
+    _REQUEST_RATE = (2, 4)
+
     @staticmethod
     def GetName():
         return 'CoinEx'
 
-    def __init__(self, api_key, api_secret):
-        self.api_url = 'https://coinex.pw/api/v2/'
+    @staticmethod
+    def GetConfigKeys():
+        return ('api_key', 'api_secret')
+
+    def __init__(self, api_key, api_secret, api_url='https://coinex.pw/api/v2/',
+                 snapshot_path=None, market_data=None, publish_market_data=False):
+        exchange_api.Exchange.__init__(self)
+        self.api_url = api_url
         self.api_headers = {'Content-type' : 'application/json',
                             'Accept' : 'application/json',
                             'User-Agent' : 'autocoin-autosell'}
         self.api_key = api_key
         self.api_secret = api_secret.encode('utf-8')
+        self._snapshot_path = snapshot_path
+
+        if market_data is not None:
+            self._SetMarketData(market_data, publish_market_data)
+        if self._IsFollowingMarketData():
+            # Another process loads the markets.
+            self._SyncMarketData()
+        elif self._LoadSnapshot():
+            # Start from the snapshot right away and revalidate it in the background.
+            thread = threading.Thread(target=self._RevalidateMarkets)
+            thread.daemon = True
+            thread.start()
+        else:
+            self._LoadMarkets()
 
+    # Replaces the currency names and markets with those described by 'currencies', a list of
+    # (id, name) tuples, and 'trade_pairs', a list of (id, currency id, market id) tuples.
+    def _SetMarkets(self, currencies, trade_pairs):
+        self._currency_names = dict(currencies)
+        markets = []
+        for (trade_pair_id, currency_id, market_id) in trade_pairs:
+            markets.append(Market(self, currency_id, market_id, trade_pair_id, False))
+            markets.append(Market(self, market_id, currency_id, trade_pair_id, True))
+        self._markets = exchange_api.MarketSnapshot(markets, self._markets.GetGeneration() + 1)
+        self._snapshot_metadata = {'currencies' : currencies, 'trade_pairs' : trade_pairs}
+
+    def _LoadMarkets(self):
         try:
-            self._currency_names = {currency['id'] : currency['name'] for
-                                    currency in self._Request('currencies')}
-            self._markets = collections.defaultdict(dict)
-            for trade_pair in self._Request('trade_pairs'):
-                market1 = Market(self, trade_pair['currency_id'], trade_pair['market_id'],
-                                 trade_pair['id'], False)
-                self._markets[market1.GetSourceCurrency()][market1.GetTargetCurrency()] = market1
-                market2 = Market(self, trade_pair['market_id'], trade_pair['currency_id'],
-                                 trade_pair['id'], True)
-                self._markets[market2.GetSourceCurrency()][market2.GetTargetCurrency()] = market2
+            currencies = [(currency['id'], currency['name']) for
+                          currency in self._Request('currencies')]
+            trade_pairs = [(trade_pair['id'], trade_pair['currency_id'], trade_pair['market_id'])
+                           for trade_pair in self._Request('trade_pairs')]
         except (TypeError, LookupError) as e:
             raise exchange_api.ExchangeException(e)
+        self._SetMarkets(currencies, trade_pairs)
+        self._SaveSnapshot()
+        self._PublishMarketData()
+
+    def _LoadSnapshot(self):
+        snapshot = self._ReadSnapshot()
+        if snapshot is None:
+            return False
+        try:
+            self._ApplyMarketMetadata(snapshot[1])
+        except (TypeError, LookupError, ValueError):
+            return False
+        self._PublishMarketData()
+        return True
+
+    def _ApplyMarketMetadata(self, metadata):
+        self._SetMarkets([tuple(currency) for currency in metadata['currencies']],
+                         [tuple(trade_pair) for trade_pair in metadata['trade_pairs']])
+
+    def _RevalidateMarkets(self):
+        while True:
+            try:
+                self._LoadMarkets()
+                return
+            except exchange_api.ExchangeException:
+                time.sleep(60)
+
+    def _GetSnapshotMetadata(self):
+        return self._snapshot_metadata
 
     def _GetCurrencyName(self, currency_id):
         return self._currency_names.get(currency_id, '#%s' % currency_id)
 
     def _Request(self, method, request_vars=None, headers=None, post_data=None, json_root=None):
         request_string = '?' + urllib.parse.urlencode(request_vars) if request_vars else ''
+        # Unsigned requests are public reads, so they can be hedged.
+        hedged = headers is None
         if headers is None:
             headers = {}
         headers.update(self.api_headers.items())
+        url = self.api_url + method + request_string
+        response = self._SendRequest(
+            method, lambda timeout: transport.HTTPRequest(url, post_data, headers, timeout),
+            hedged, method in _PRIORITY_METHODS)
         try:
-            request = urllib.request.Request(self.api_url + method + request_string,
-                                             post_data, headers)
-            response = urllib.request.urlopen(request)
-            try:
-                response_json = json.loads(response.read().decode('utf-8'))
-                if not json_root:
-                    json_root = method
-                if not json_root in response_json:
-                    raise exchange_api.ExchangeException('JSON root "%s" not in "%s".' %
-                                                         (json_root, method))
-                return response_json[json_root]
-            finally:
-                response.close()
-        except (urllib.error.URLError, urllib.error.HTTPError, http.client.HTTPException,
-                ValueError) as e:
+            response_json = json.loads(response.decode('utf-8'))
+        except ValueError as e:
             raise exchange_api.ExchangeException(e)
+        if not json_root:
+            json_root = method
+        if not json_root in response_json:
+            raise exchange_api.ExchangeException('JSON root "%s" not in "%s".' %
+                                                 (json_root, method))
+        return response_json[json_root]
 
     def _PrivateRequest(self, method, post_data=None, json_root=None):
         hmac_data = b'' if not post_data else post_data
@@ -128,9 +192,6 @@ class CoinEx(exchange_api.Exchange):
     def GetCurrencies(self):
         return self._currency_names.values()
 
-    def GetMarkets(self):
-        return self._markets
-
     def GetBalances(self):
         balances = {}
         try:
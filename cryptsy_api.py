@@ -1,35 +1,73 @@
-import collections
 import exchange_api
 import hashlib
 import hmac
 import json
+import metrics
+import re
+import threading
 import time
-import _thread
+import transport
+
+# Reads, which can be resent when a kept-alive connection turns out to have been closed. Every
+# request is a POST, so orders must not be.
+_IDEMPOTENT_METHODS = frozenset(['getinfo', 'getmarkets', 'marketorders'])
+# Market data refreshes, which go ahead of balance checks and orders so prices don't go stale.
+_PRIORITY_METHODS = frozenset(['getmarkets'])
+# Price history older than this many seconds isn't restored from a snapshot.
+_SNAPSHOT_MAX_PRICE_AGE = 300
+# While market data is pushed, markets are still refreshed this often, in seconds, to pick up new
+# ones.
+_STREAMING_REFRESH_DELAY = 60
 
 try:
-    import http.client
-    import urllib.request
-    import urllib.error
     import urllib.parse
 except ImportError:
     # Python 2.7 compatbility
-    import httplib
-    class http: client = httplib
     import urllib
-    import urllib2
-    class urllib: request = urllib2; error = urllib2; parse = urllib
+    class urllib: parse = urllib
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def _SkipWhitespace(text, index):
+    return _JSON_WHITESPACE.match(text, index).end()
+
+# Checks that text[index] is 'expected' and returns the index of the next token after it.
+def _Expect(text, index, expected):
+    if text[index:index + 1] != expected:
+        raise ValueError('Expected "%s" at %d.' % (expected, index))
+    return _SkipWhitespace(text, index + 1)
+
+# Reads what follows an element of a JSON array or object ending before text[index]: either a ","
+# and the next element, or the 'close' bracket. Returns (whether another element follows, index
+# of the next token).
+def _NextElement(text, index, close):
+    index = _SkipWhitespace(text, index)
+    if text[index:index + 1] == ',':
+        return (True, _SkipWhitespace(text, index + 1))
+    return (False, _Expect(text, index, close))
+
+# Reads the 'opening' bracket of a JSON array or object at text[index]. Returns (whether it has
+# any elements, index of the next token).
+def _FirstElement(text, index, opening, close):
+    index = _Expect(text, index, opening)
+    if text[index:index + 1] == close:
+        return (False, _SkipWhitespace(text, index + 1))
+    return (True, index)
 
 class Market(exchange_api.Market):
+    __slots__ = ('_source_currency', '_target_currency', '_market_id', '_reverse_market',
+                 '_price_slot')
     _TRADE_MINIMUMS = {('Points', 'BTC') : 0.1}
 
-    def __init__(self, exchange, source_currency, target_currency, market_id, reverse_market, prices=[-1,-1,-1,-1,-1,-1,], day_max_price=0):
+    def __init__(self, exchange, source_currency, target_currency, market_id, reverse_market,
+                 price_slot):
         exchange_api.Market.__init__(self, exchange)
         self._source_currency = source_currency
         self._target_currency = target_currency
         self._market_id = market_id
         self._reverse_market = reverse_market
-        self._prices = prices
-        self._day_max_price = day_max_price
+        self._price_slot = price_slot
 
     def GetSourceCurrency(self):
         return self._source_currency
@@ -40,27 +78,49 @@ class Market(exchange_api.Market):
     def GetTradeMinimum(self):
         return self._TRADE_MINIMUMS.get((self._source_currency, self._target_currency), 0.0000001)
 
+    def GetPriceSlot(self):
+        return self._price_slot
+
+    def GetPriceVersion(self):
+        return self._exchange._prices.GetVersion(self._price_slot)
+
     def GetPrices(self):
-        return self._prices
+        return self._exchange._prices.GetPrices(self._price_slot)
 
     def GetDayMaxPrice(self):
-        return self._day_max_price
+        return self._exchange._prices.GetDayMaxPrice(self._price_slot)
+
+    def GetPriceTick(self):
+        return self._exchange._prices.GetTick(self._price_slot)
 
-    def GetPublicOrders(self):
+    def _FetchOrderBook(self):
+        orders = self._exchange._Request('marketorders', {'marketid' : self._market_id})
         try:
-            post_dict = {'marketid' : self._market_id}
-            orders = self._exchange._Request('marketorders', post_dict)['return']
-            return ([exchange_api.Order(self, 'N/A', True,
-                                        float(order['quantity']),
-                                        float(order['buyprice'])) for
-                     order in orders.get('buyorders', [])],
-                    [exchange_api.Order(self, 'N/A', False,
-                                        float(order['quantity']),
-                                        float(order['sellprice'])) for
-                     order in orders.get('sellorders', [])])
-        except (TypeError, LookupError) as e:
+            buy_orders = orders['return'].get('buyorders') or []
+            sell_orders = orders['return'].get('sellorders') or []
+            return exchange_api.OrderBook(
+                [float(order['buyprice']) for order in buy_orders],
+                [float(order['quantity']) for order in buy_orders],
+                [float(order['sellprice']) for order in sell_orders],
+                [float(order['quantity']) for order in sell_orders])
+        except (TypeError, LookupError, ValueError, AttributeError) as e:
             raise exchange_api.ExchangeException(e)
 
+    def _GetOrderBookKey(self):
+        return self._market_id
+
+    def GetOrderBook(self):
+        return self._exchange.GetOrderBookCache().Get(self._market_id, self._FetchOrderBook)
+
+    def GetBestBid(self):
+        order_book = self.GetOrderBook()
+        best_bid = order_book.GetBestBid()
+        if best_bid is not None and self._exchange._tick_recorder is not None:
+            self._exchange._tick_recorder.RecordOrderBook(
+                time.time(), self._source_currency, self._target_currency, best_bid,
+                order_book.GetBids()[1][0])
+        return best_bid
+
     def CreateOrder(self, bid_order, amount, price):
         if self._reverse_market:
             bid_order = not bid_order
@@ -70,101 +130,318 @@ class Market(exchange_api.Market):
                      'price' : max(0.0000001, price)}
         try:
             order_id = self._exchange._Request('createorder', post_dict)['orderid']
+            self._exchange.GetOrderBookCache().Invalidate(self._market_id)
             return exchange_api.Order(self, order_id, bid_order, amount, price)
         except (TypeError, LookupError) as e:
             raise exchange_api.ExchangeException(e)
 
 class Cryptsy(exchange_api.Exchange):
+    _REQUEST_RATE = (1, 3)
+
     @staticmethod
     def GetName():
         return 'Cryptsy'
 
-    def __init__(self, api_public_key, api_private_key):
-        self.api_auth_url = 'https://api.cryptsy.com/api'
+    @staticmethod
+    def GetConfigKeys():
+        return ('api_private_key', 'api_public_key')
+
+    def __init__(self, api_public_key, api_private_key, api_url='https://api.cryptsy.com/api',
+                 snapshot_path=None, market_data=None, publish_market_data=False):
+        exchange_api.Exchange.__init__(self)
+        self.api_auth_url = api_url
         self.api_headers = {'Content-type' : 'application/x-www-form-urlencoded',
                             'Accept' : 'application/json',
                             'User-Agent' : 'autocoin-autosell'}
         self.api_public_key = api_public_key
         self.api_private_key = api_private_key.encode('utf-8')
+        self._nonce_counter = None
+        # The latest pushed (last trade, day's max price) of each market, by (source currency,
+        # target currency), until _ApplyPushedPrices records them.
+        self._pushed_prices = {}
+        self._pushed_prices_lock = threading.Lock()
 
-        self._markets = collections.defaultdict(dict)
-        try:
-            self._LoadMarkets();
-        except (TypeError, LookupError) as e:
-            raise exchange_api.ExchangeException(e)
+        self._snapshot_path = snapshot_path
 
-        _thread.start_new_thread(self._MarketRefreshLoop, ())
+        if market_data is not None:
+            self._SetMarketData(market_data, publish_market_data)
+            self._prices = market_data.GetPriceStore()
+            # The publishing process may sign requests with the same key.
+            self._nonce_counter = market_data.GetNonceCounter((api_private_key, api_public_key))
+        else:
+            self._prices = exchange_api.PriceStore(depth=6)
+        if self._nonce_counter is None:
+            self._nonce_counter = transport.NonceCounter()
+        if self._IsFollowingMarketData():
+            # Another process refreshes the markets and prices.
+            self._SyncMarketData()
+            return
 
-    def _LoadMarkets(self):
+        # Start from the snapshot right away, if there is one, and revalidate it in the
+        # background.
+        revalidate = self._LoadSnapshot()
+        if not revalidate:
             try:
-                for market in self._Request('getmarkets')['return']:
-                    market1 = Market(self, market['primary_currency_code'],
-                            market['secondary_currency_code'], market['marketid'], False)
-                    self._markets[market1.GetSourceCurrency()][market1.GetTargetCurrency()] = market1
-                    market2 = Market(self, market['secondary_currency_code'],
-                            market['primary_currency_code'], market['marketid'], True)
-                    self._markets[market2.GetSourceCurrency()][market2.GetTargetCurrency()] = market2
-            except ExchangeException as e:
-                _Log('Failed to get market: %s', e)
+                self._LoadMarkets()
+            except (TypeError, LookupError, ValueError) as e:
+                raise exchange_api.ExchangeException(e)
+        self._PublishMarketData()
+
+        thread = threading.Thread(target=self._MarketRefreshLoop, args=(revalidate,))
+        thread.daemon = True
+        thread.start()
 
+    # Publishes a new MarketSnapshot with both directions of each of the getmarkets entries in
+    # 'markets' added, unless they're already known. Only the market refresh thread (or the
+    # constructor, before it starts) may call this.
+    def _AddMarkets(self, markets):
+        snapshot = self._markets
+        new_markets = []
+        new_pairs = set()
+        for market in markets:
+            primary_currency = market['primary_currency_code']
+            secondary_currency = market['secondary_currency_code']
+            if (snapshot.HasMarket(primary_currency, secondary_currency) or
+                (primary_currency, secondary_currency) in new_pairs):
+                continue
+            new_pairs.add((primary_currency, secondary_currency))
+            new_markets.append(Market(self, primary_currency, secondary_currency,
+                                      market['marketid'], False, self._prices.AddSlot()))
+            new_markets.append(Market(self, secondary_currency, primary_currency,
+                                      market['marketid'], True, self._prices.AddSlot()))
+        if new_markets:
+            self._markets = snapshot.Add(new_markets)
+
+    # Yields the entries of a getmarkets response one at a time as they are decoded, rather than
+    # decoding the whole response up front. Unless 'all_markets' is set, entries for markets that
+    # don't pass the currency filter are dropped as soon as they're read.
+    def _IterMarkets(self, all_markets=False):
+        text = self._RequestText('getmarkets')
+        (more_keys, index) = _FirstElement(text, _SkipWhitespace(text, 0), '{', '}')
+        found_return = False
+        while more_keys:
+            if text[index:index + 1] != '"':
+                raise ValueError('Expected a key at %d.' % index)
+            (key, index) = _JSON_DECODER.raw_decode(text, index)
+            index = _Expect(text, _SkipWhitespace(text, index), ':')
+            if key != 'return':
+                (value, index) = _JSON_DECODER.raw_decode(text, index)
+                if key == 'error' and value:
+                    raise exchange_api.ExchangeException(value)
+            else:
+                found_return = True
+                (more_markets, index) = _FirstElement(text, index, '[', ']')
+                while more_markets:
+                    (market, index) = _JSON_DECODER.raw_decode(text, index)
+                    primary_currency = market['primary_currency_code']
+                    secondary_currency = market['secondary_currency_code']
+                    if (all_markets or
+                        self._IsRelevantMarket(primary_currency, secondary_currency) or
+                        self._IsRelevantMarket(secondary_currency, primary_currency)):
+                        yield market
+                    (more_markets, index) = _NextElement(text, index, ']')
+            (more_keys, index) = _NextElement(text, index, '}')
+        if not found_return:
+            raise exchange_api.ExchangeException('JSON root "return" not in "getmarkets".')
+
+    def _LoadMarkets(self):
+        self._AddMarkets(self._IterMarkets(all_markets=True))
+
+    # Collects the prices of the getmarkets entries as they are decoded, then records them all
+    # at once. Only the entries of new markets are kept until the snapshot adding those markets
+    # is published, and their prices are collected after that.
     def _RefreshMarkets(self):
+        markets = self._markets
+        new_markets = []
+        new_ticks = []
+        price_ticks = []
+        ticks = [] if self._tick_recorder is not None else None
+        for market in self._IterMarkets():
+            tick = (market['primary_currency_code'], market['secondary_currency_code'],
+                    float(market['last_trade']), float(market['high_trade']))
+            if markets.HasMarket(tick[0], tick[1]):
+                price_ticks.extend(self._GetPriceTicks(markets, *tick))
+            else:
+                new_markets.append(market)
+                new_ticks.append(tick)
+            if ticks is not None:
+                ticks.append(tick)
+        if new_markets:
+            self._AddMarkets(new_markets)
+            markets = self._markets
+            for tick in new_ticks:
+                price_ticks.extend(self._GetPriceTicks(markets, *tick))
+        self._prices.AddTicks(price_ticks)
+        if ticks is not None:
+            self._tick_recorder.RecordPrices(time.time(), ticks)
+
+    # Returns the PriceStore ticks recording the last trade and day's high of the market listed
+    # as 'primary_currency' / 'secondary_currency' in 'markets', a MarketSnapshot, and their
+    # inverses for the reverse market.
+    def _GetPriceTicks(self, markets, primary_currency, secondary_currency, last_trade,
+                       high_trade):
+        return ((markets[primary_currency][secondary_currency]._price_slot, last_trade,
+                 high_trade),
+                (markets[secondary_currency][primary_currency]._price_slot,
+                 1 / last_trade if last_trade > 0 else 0,
+                 1 / high_trade if high_trade > 0 else 0))
+
+    # Keeps only the latest pushed price of each market. The sell rules count a flat price over
+    # the last few refreshes, so pushed prices go into the price history at the same pace as
+    # polled ones, once per market refresh delay, by _ApplyPushedPrices.
+    def _OnPriceUpdate(self, source_currency, target_currency, last_trade, day_max_price):
+        markets = self._markets
+        if not markets.HasMarket(source_currency, target_currency):
+            return []
+        if markets[source_currency][target_currency]._reverse_market:
+            (source_currency, target_currency) = (target_currency, source_currency)
+            last_trade = 1 / last_trade if last_trade > 0 else 0
+            day_max_price = 1 / day_max_price if day_max_price > 0 else 0
+        if self._tick_recorder is not None:
+            self._tick_recorder.RecordPrices(
+                time.time(), [(source_currency, target_currency, last_trade, day_max_price)])
+        with self._pushed_prices_lock:
+            self._pushed_prices[(source_currency, target_currency)] = (last_trade, day_max_price)
+        return []
+
+    # Returns the pushed prices kept since the last call, and forgets them.
+    def _TakePushedPrices(self):
+        with self._pushed_prices_lock:
+            (pushed_prices, self._pushed_prices) = (self._pushed_prices, {})
+        return pushed_prices
+
+    # Records the latest pushed price of each market that had one pushed since the last call,
+    # and wakes WaitForMarketUpdates() callers for them.
+    def _ApplyPushedPrices(self):
+        markets = self._markets
+        price_ticks = []
+        updated_markets = []
+        for ((source_currency, target_currency), (last_trade, day_max_price)) in (
+                self._TakePushedPrices().items()):
+            price_ticks.extend(self._GetPriceTicks(markets, source_currency, target_currency,
+                                                   last_trade, day_max_price))
+            updated_markets.extend((markets[source_currency][target_currency],
+                                    markets[target_currency][source_currency]))
+        self._prices.AddTicks(price_ticks)
+        self._NotifyMarketUpdates(updated_markets)
+
+    def _LoadSnapshot(self):
+        snapshot = self._ReadSnapshot()
+        if snapshot is None:
+            return False
+        (snapshot_time, metadata, arrays) = snapshot
         try:
-            for market in self._Request('getmarkets')['return']:
-                prices = self._markets[market['primary_currency_code']][market['secondary_currency_code']].GetPrices()
-                prices.insert(0,float(market['last_trade']))
-                prices.pop()
-                market1 = Market(self, market['primary_currency_code'],
-                        market['secondary_currency_code'], market['marketid'], False, prices, float(market['high_trade']))
-                self._markets[market1.GetSourceCurrency()][market1.GetTargetCurrency()] = market1
-
-                prices = self._markets[market['secondary_currency_code']][market['primary_currency_code']].GetPrices()
-                prices.insert(0,1/float(market['last_trade']))
-                prices.pop()
-                if float(market['high_trade']) > 0:
-                    highval = 1/float(market['high_trade'])
-                else:
-                    highval = 0
-                market2 = Market(self, market['secondary_currency_code'],
-                        market['primary_currency_code'], market['marketid'], True, prices, highval)
-                self._markets[market2.GetSourceCurrency()][market2.GetTargetCurrency()] = market2
-        except ExchangeException as e:
-            _Log('Failed to get market: %s', e)
-
-    def _MarketRefreshLoop(self):
+            if arrays and time.time() - snapshot_time < _SNAPSHOT_MAX_PRICE_AGE:
+                self._prices.Restore(*arrays)
+                self._ApplyMarketMetadata(metadata)
+            else:
+                self._AddMarkets({'primary_currency_code' : primary_currency,
+                                  'secondary_currency_code' : secondary_currency,
+                                  'marketid' : market_id} for
+                                 (primary_currency, secondary_currency, market_id, _, _) in
+                                 metadata['markets'])
+        except (TypeError, LookupError, ValueError):
+            self._markets = exchange_api.MarketSnapshot((), self._markets.GetGeneration() + 1)
+            self._prices.Restore([], [], [])
+            return False
+        return True
+
+    def _ApplyMarketMetadata(self, metadata):
+        markets = []
+        for (primary_currency, secondary_currency, market_id, slot1, slot2) in metadata['markets']:
+            markets.append(Market(self, primary_currency, secondary_currency, market_id, False,
+                                  slot1))
+            markets.append(Market(self, secondary_currency, primary_currency, market_id, True,
+                                  slot2))
+        self._markets = exchange_api.MarketSnapshot(markets, self._markets.GetGeneration() + 1)
+
+    def _GetSnapshotMetadata(self):
+        snapshot = self._markets
+        markets = []
+        for market in snapshot.IterMarkets():
+            if not market._reverse_market:
+                reverse_market = snapshot[market._target_currency][market._source_currency]
+                markets.append([market._source_currency, market._target_currency,
+                                market._market_id, market._price_slot, reverse_market._price_slot])
+        return {'markets' : markets}
+
+    def _MarketRefreshLoop(self, revalidate):
+        last_refresh = 0
         while True:
-            time.sleep(5)
-            self._RefreshMarkets()
+            if revalidate:
+                # Pick up markets listed since the snapshot was written.
+                try:
+                    self._LoadMarkets()
+                    revalidate = False
+                except (exchange_api.ExchangeException, TypeError, LookupError, ValueError):
+                    pass
+            time.sleep(self._market_refresh_delay)
+            if self.IsStreaming() and time.time() - last_refresh < _STREAMING_REFRESH_DELAY:
+                self._ApplyPushedPrices()
+                continue
+            # The refresh supersedes any prices pushed since the last one.
+            self._TakePushedPrices()
+            try:
+                with metrics.Timer(metrics.MARKET_REFRESH_SECONDS, (self.GetName(),)):
+                    self._RefreshMarkets()
+                last_refresh = time.time()
+            except (exchange_api.ExchangeException, TypeError, LookupError, ValueError) as e:
+                metrics.FAILURES.Increment((self.GetName(), 'market_refresh',
+                                            metrics.GetErrorType(e)))
+                continue  # keep the previous prices and try again on the next refresh
+            self._SaveSnapshot()
+            self._PublishMarketData()
 
-    def _Request(self, method, post_dict=None):
-        if post_dict is None:
-            post_dict = {}
-        post_dict['method'] = method
-        post_dict['nonce'] = int(time.time())
+    # Signs 'post_dict' with a new nonce and returns the request's (post_data, headers).
+    def _Sign(self, post_dict):
+        post_dict = dict(post_dict)
+        post_dict['nonce'] = self._nonce_counter.Next()
         post_data = urllib.parse.urlencode(post_dict).encode('utf-8')
         digest = hmac.new(self.api_private_key, post_data, hashlib.sha512).hexdigest()
         headers = {'Key' : self.api_public_key,
                    'Sign': digest}
         headers.update(self.api_headers.items())
+        return (post_data, headers)
+
+    # Sends a signed request. Requests made with this API key, from any thread or process sharing
+    # the nonce counter, are written in nonce order.
+    def _Send(self, post_dict, timeout):
+        return transport.HTTPRequest(self.api_auth_url, timeout=timeout,
+                                     sign=lambda: self._Sign(post_dict),
+                                     write_lock=self._nonce_counter.GetLock(),
+                                     idempotent=post_dict['method'] in _IDEMPOTENT_METHODS)
 
+    # Sends a signed request and returns the undecoded response text.
+    def _RequestText(self, method, post_dict=None):
+        if post_dict is None:
+            post_dict = {}
+        post_dict['method'] = method
+        # Every request is signed, so none are hedged: a hedge would take a higher nonce while the
+        # first attempt is still in flight, and the exchange would reject whichever arrived last.
+        response = self._SendRequest(method, lambda timeout: self._Send(post_dict, timeout),
+                                     priority=method in _PRIORITY_METHODS)
         try:
-            request = urllib.request.Request(self.api_auth_url, post_data, headers)
-            response = urllib.request.urlopen(request)
-            try:
-                response_json = json.loads(response.read().decode('utf-8'))
-                if 'error' in response_json and response_json['error']:
-                    raise exchange_api.ExchangeException(response_json['error'])
-                return response_json
-            finally:
-                response.close()
-        except (urllib.error.URLError, urllib.error.HTTPError, http.client.HTTPException,
-                ValueError) as e:
+            return response.decode('utf-8')
+        except ValueError as e:
             raise exchange_api.ExchangeException(e)
 
+    def _Request(self, method, post_dict=None):
+        try:
+            response_json = json.loads(self._RequestText(method, post_dict))
+        except ValueError as e:
+            raise exchange_api.ExchangeException(e)
+        if 'error' in response_json and response_json['error']:
+            raise exchange_api.ExchangeException(response_json['error'])
+        return response_json
+
     def GetCurrencies(self):
-        return self._markets.keys()
+        return self.GetMarkets().keys()
+
+    def GetPriceStore(self):
+        return self._prices
 
-    def GetMarkets(self):
-        return self._markets
+    def RecordsTicks(self):
+        return True
 
     def GetBalances(self):
         try:
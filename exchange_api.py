@@ -1,12 +1,235 @@
-# An exception that any methods in exchange may raise.
-class ExchangeException(Exception):
+import array
+import collections
+import collections.abc
+import http.client
+import itertools
+import json
+import metrics
+import os
+import socket
+import struct
+import threading
+import time
+import transport
+import types
+import urllib.parse
 
-    def __init__(self, exception):
-        message = '[%s] %s' % (type(exception).__name__, exception)
-        Exception.__init__(self, message)
+# Re-exported from transport, where requests raise it: an exception that any methods in
+# exchange may raise.
+ExchangeException = transport.ExchangeException
+
+# Price history for all of an exchange's markets, kept in one contiguous array. Each market owns
+# a slot holding a ring buffer of its last 'depth' prices plus its day's max price, so refreshing
+# prices only overwrites floats in place.
+class PriceStore(object):
+    def __init__(self, depth=6, initial_price=-1):
+        self._depth = depth
+        self._initial_price = initial_price
+        self._prices = array.array('d')
+        self._heads = array.array('l')
+        self._day_max_prices = array.array('d')
+        self._versions = array.array('L')
+        self._lock = threading.Lock()
+
+    def GetDepth(self):
+        return self._depth
+
+    # Allocates a new market slot and returns its index.
+    def AddSlot(self):
+        with self._lock:
+            self._prices.extend([self._initial_price] * self._depth)
+            self._heads.append(0)
+            self._day_max_prices.append(0)
+            self._versions.append(0)
+            return len(self._heads) - 1
+
+    # Records 'price' as the newest price of 'slot', dropping the oldest, and 'day_max_price' as
+    # its day's max price.
+    def AddTick(self, slot, price, day_max_price):
+        self.AddTicks(((slot, price, day_max_price),))
+
+    # Records each (slot, price, day_max_price) of 'ticks' as AddTick does, all under one lock,
+    # so a reader sees either none or all of a refresh.
+    def AddTicks(self, ticks):
+        with self._lock:
+            for (slot, price, day_max_price) in ticks:
+                head = (self._heads[slot] + 1) % self._depth
+                self._heads[slot] = head
+                self._prices[slot * self._depth + head] = price
+                self._day_max_prices[slot] = day_max_price
+                self._versions[slot] += 1
+
+    def _GetRing(self, slot):
+        start = slot * self._depth
+        ring = self._prices[start:start + self._depth]
+        head = self._heads[slot]
+        return ring[head::-1].tolist() + ring[:head:-1].tolist()
+
+    # Returns the prices of 'slot' as a list, newest first.
+    def GetPrices(self, slot):
+        with self._lock:
+            return self._GetRing(slot)
+
+    def GetDayMaxPrice(self, slot):
+        return self._day_max_prices[slot]
+
+    # Returns the (prices, day's max price) of 'slot', as recorded by the same refresh.
+    def GetTick(self, slot):
+        with self._lock:
+            return (self._GetRing(slot), self._day_max_prices[slot])
+
+    # Returns a counter that changes whenever the prices of 'slot' change.
+    def GetVersion(self, slot):
+        return self._versions[slot]
+
+    # Returns consistent copies of the (prices, heads, day max prices) arrays. Slot i's ring
+    # buffer is prices[i * depth:(i + 1) * depth] and its newest price is at offset heads[i].
+    def Copy(self):
+        with self._lock:
+            return (self._prices[:], self._heads[:], self._day_max_prices[:])
+
+    # Replaces the store's contents with arrays previously returned by Copy().
+    def Restore(self, prices, heads, day_max_prices):
+        if len(prices) != len(heads) * self._depth or len(day_max_prices) != len(heads):
+            raise ValueError('Inconsistent price store arrays.')
+        with self._lock:
+            self._prices = array.array('d', prices)
+            self._heads = array.array('l', heads)
+            self._day_max_prices = array.array('d', day_max_prices)
+            self._versions = array.array('L', [0] * len(heads))
+
+# A cache of fetched order books, keyed by market. Entries expire after 'ttl' seconds, and the
+# least recently used entries are evicted once there are more than 'max_entries'.
+class OrderBookCache(object):
+    def __init__(self, ttl=2, max_entries=64):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def SetTTL(self, ttl):
+        self._ttl = ttl
+
+    # Returns the cached order book for 'key', calling 'fetch' to get a fresh one if there is no
+    # entry or it expired.
+    def Get(self, key, fetch):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and now - entry[0] < self._ttl:
+                self._entries[key] = entry
+                return entry[1]
+
+        order_book = fetch()
+        self.Put(key, order_book, now)
+        return order_book
+
+    # Stores 'order_book' for 'key' as fetched at 'now' (or the current time), e.g. when it was
+    # pushed by a MarketDataStream.
+    def Put(self, key, order_book, now=None):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() if now is None else now, order_book)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    # Drops the entry for 'key', e.g. after placing an order that changed the book.
+    def Invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+# A persistent connection that market data updates are pushed over. Each update is a dict:
+#   {'type' : 'price', 'source' : 'DOGE', 'target' : 'BTC',
+#    'last_trade' : 0.0000012, 'day_max_price' : 0.0000013}
+#   {'type' : 'order_book', 'source' : 'DOGE', 'target' : 'BTC',
+#    'bids' : [[price, amount], ...], 'asks' : [[price, amount], ...]}
+#   {'type' : 'heartbeat'}
+# where 'source' and 'target' name the market as the exchange lists it.
+class MarketDataStream(object):
+    # Connects and yields updates until the stream ends. Raises an ExchangeException if the
+    # connection fails or drops.
+    def IterUpdates(self):
+        raise NotImplementedError
+
+# A MarketDataStream that reads one JSON update per line from a long-lived HTTP GET response,
+# e.g. from mock_exchanges.MockStream. Blank lines are heartbeats; the stream is considered
+# down if not even a heartbeat arrives for 'timeout' seconds.
+class JSONLinesStream(MarketDataStream):
+    def __init__(self, url, timeout=30):
+        self._url = url
+        self._timeout = timeout
+
+    def IterUpdates(self):
+        url_parts = urllib.parse.urlsplit(self._url)
+        path = (url_parts.path or '/') + ('?' + url_parts.query if url_parts.query else '')
+        connection_class = (http.client.HTTPSConnection if url_parts.scheme == 'https' else
+                            http.client.HTTPConnection)
+        connection = connection_class(url_parts.hostname, url_parts.port, timeout=self._timeout)
+        try:
+            connection.request('GET', path, headers={'Accept' : 'application/x-ndjson'})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise ExchangeException(http.client.HTTPException(
+                    'HTTP %d %s' % (response.status, response.reason)))
+            while True:
+                line = response.readline()
+                if not line:
+                    return
+                line = line.strip()
+                yield json.loads(line.decode('utf-8')) if line else {'type' : 'heartbeat'}
+        except (http.client.HTTPException, socket.error, ValueError) as e:
+            raise ExchangeException(e)
+        finally:
+            connection.close()
+
+_SNAPSHOT_MAGIC = b'altcoin-autosell snapshot 1\n'
+
+# Atomically writes an exchange snapshot to 'path': a JSON header holding 'metadata' followed by
+# the raw arrays of 'price_store', if given.
+def WriteSnapshot(path, metadata, price_store=None):
+    arrays = price_store.Copy() if price_store is not None else ()
+    header = json.dumps({'time' : time.time(),
+                         'metadata' : metadata,
+                         'arrays' : [[values.typecode, len(values)] for values in arrays]})
+    header = header.encode('utf-8')
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as snapshot_file:
+        snapshot_file.write(_SNAPSHOT_MAGIC)
+        snapshot_file.write(struct.pack('<I', len(header)))
+        snapshot_file.write(header)
+        for values in arrays:
+            snapshot_file.write(values.tobytes())
+    os.rename(temp_path, path)
+
+# Reads a snapshot written by WriteSnapshot. Returns a (time, metadata, arrays) tuple, where
+# 'arrays' can be passed to PriceStore.Restore. Raises IOError or ValueError if the snapshot is
+# missing or corrupt.
+def ReadSnapshot(path):
+    with open(path, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    if not data.startswith(_SNAPSHOT_MAGIC):
+        raise ValueError('Not a snapshot: %s' % path)
+    offset = len(_SNAPSHOT_MAGIC)
+    (header_size,) = struct.unpack_from('<I', data, offset)
+    offset += struct.calcsize('<I')
+    header = json.loads(data[offset:offset + header_size].decode('utf-8'))
+    offset += header_size
+
+    arrays = []
+    for (typecode, length) in header['arrays']:
+        values = array.array(str(typecode))
+        size = length * values.itemsize
+        if offset + size > len(data):
+            raise ValueError('Truncated snapshot: %s' % path)
+        values.frombytes(data[offset:offset + size])
+        arrays.append(values)
+        offset += size
+    return (header['time'], header['metadata'], arrays)
 
 # An order.
 class Order(object):
+    __slots__ = ('_market', '_order_id', '_bid_order', '_amount', '_price', '_time', '_id')
+
     def __init__(self, market, order_id, bid_order, amount, price, time=None, id_num=None):
         self._market = market
         self._order_id = order_id
@@ -37,8 +260,98 @@ class Order(object):
     def GetID(self):
         return self._id
 
+# Returns 'prices', 'amounts' and 'order_ids' (or None) of one side of an order book as arrays
+# (and a list) sorted by price, best first, i.e. 'descending' for bids.
+def _SortOrderBookSide(prices, amounts, order_ids, descending):
+    prices = array.array('d', prices)
+    amounts = array.array('d', amounts)
+    if len(amounts) != len(prices) or (order_ids is not None and len(order_ids) != len(prices)):
+        raise ValueError('Order book prices, amounts and order ids differ in length.')
+    # Exchanges usually return sorted books already.
+    if any((price < next_price) if descending else (price > next_price) for
+           (price, next_price) in zip(prices, prices[1:])):
+        order = sorted(range(len(prices)), key=prices.__getitem__, reverse=descending)
+        prices = array.array('d', [prices[index] for index in order])
+        amounts = array.array('d', [amounts[index] for index in order])
+        if order_ids is not None:
+            order_ids = [order_ids[index] for index in order]
+    return (prices, amounts, order_ids)
+
+# A market's order book, kept as parallel arrays of prices and amounts for each side: bids
+# highest price first, asks lowest price first. Order ids are optional, and Orders are only
+# created when asked for. Order books don't reference their market, so they can be cached and
+# shared between processes.
+class OrderBook(object):
+    __slots__ = ('_bid_prices', '_bid_amounts', '_bid_order_ids',
+                 '_ask_prices', '_ask_amounts', '_ask_order_ids')
+
+    def __init__(self, bid_prices=(), bid_amounts=(), ask_prices=(), ask_amounts=(),
+                 bid_order_ids=None, ask_order_ids=None):
+        (self._bid_prices, self._bid_amounts, self._bid_order_ids) = _SortOrderBookSide(
+            bid_prices, bid_amounts, bid_order_ids, True)
+        (self._ask_prices, self._ask_amounts, self._ask_order_ids) = _SortOrderBookSide(
+            ask_prices, ask_amounts, ask_order_ids, False)
+
+    def _GetSide(self, bid_side):
+        if bid_side:
+            return (self._bid_prices, self._bid_amounts, self._bid_order_ids)
+        return (self._ask_prices, self._ask_amounts, self._ask_order_ids)
+
+    # Returns the (prices, amounts) arrays of the bids, best first. Don't modify them.
+    def GetBids(self):
+        return (self._bid_prices, self._bid_amounts)
+
+    # Returns the (prices, amounts) arrays of the asks, best first. Don't modify them.
+    def GetAsks(self):
+        return (self._ask_prices, self._ask_amounts)
+
+    # Returns the highest bid price, or None if there are no bids.
+    def GetBestBid(self):
+        return self._bid_prices[0] if self._bid_prices else None
+
+    # Returns the lowest ask price, or None if there are no asks.
+    def GetBestAsk(self):
+        return self._ask_prices[0] if self._ask_prices else None
+
+    # Returns the total amount of the bids (if 'bid_side') or asks priced at 'limit_price' or
+    # better.
+    def GetDepth(self, bid_side, limit_price):
+        (prices, amounts, _) = self._GetSide(bid_side)
+        depth = 0
+        for (price, amount) in zip(prices, amounts):
+            if (price < limit_price) if bid_side else (price > limit_price):
+                break
+            depth += amount
+        return depth
+
+    # Walks the bids (if 'bid_side') or asks from the best price, as an order for 'amount' that
+    # takes them would. Returns the (amount filled, total price, worst price reached) tuple; the
+    # worst price is None if nothing was filled.
+    def GetFill(self, bid_side, amount):
+        (prices, amounts, _) = self._GetSide(bid_side)
+        filled = 0
+        total = 0
+        worst_price = None
+        for (price, available) in zip(prices, amounts):
+            if filled >= amount:
+                break
+            taken = min(available, amount - filled)
+            filled += taken
+            total += taken * price
+            worst_price = price
+        return (filled, total, worst_price)
+
+    # Yields an Order of 'market' for each bid (if 'bid_side') or ask, best first.
+    def IterOrders(self, market, bid_side):
+        (prices, amounts, order_ids) = self._GetSide(bid_side)
+        for index in range(len(prices)):
+            yield Order(market, 'N/A' if order_ids is None else order_ids[index], bid_side,
+                        amounts[index], prices[index])
+
 # An available market.
 class Market(object):
+    __slots__ = ('_exchange',)
+
     def __init__(self, exchange):
         self._exchange = exchange
 
@@ -57,9 +370,43 @@ class Market(object):
     def GetTradeMinimum(self):
         raise NotImplementedError
 
+    # Returns the most recent last-trade prices, newest first, or an empty list if the exchange
+    # doesn't track price history.
+    def GetPrices(self):
+        return []
+
+    # Returns the highest trade price of the last day, or 0 if unknown.
+    def GetDayMaxPrice(self):
+        return 0
+
+    # Returns (GetPrices(), GetDayMaxPrice()), both from the same price refresh.
+    def GetPriceTick(self):
+        return (self.GetPrices(), self.GetDayMaxPrice())
+
+    # Returns a counter that changes whenever GetPrices() or GetDayMaxPrice() change.
+    def GetPriceVersion(self):
+        return 0
+
+    # Returns the slot holding this market's prices in its exchange's PriceStore, or None.
+    def GetPriceSlot(self):
+        return None
+
+    # Returns the key of the market's entry in its exchange's OrderBookCache.
+    def _GetOrderBookKey(self):
+        raise NotImplementedError
+
+    # Returns the market's OrderBook.
+    def GetOrderBook(self):
+        raise NotImplementedError
+
     # Returns a tuple of buy and sell Orders.
     def GetPublicOrders(self):
-        raise NotImplementedError
+        order_book = self.GetOrderBook()
+        return (list(order_book.IterOrders(self, True)), list(order_book.IterOrders(self, False)))
+
+    # Returns the highest buy order price, or None if there are no buy orders.
+    def GetBestBid(self):
+        return self.GetOrderBook().GetBestBid()
 
     # Creates an order.
     # If 'bid_order' is True, this is a bid/buy order, otherwise an ask/sell order.
@@ -67,20 +414,97 @@ class Market(object):
     def CreateOrder(self, bid_order, amount, price):
         raise NotImplementedError
 
+# An immutable set of an exchange's markets: a mapping of source currency to a read-only mapping
+# of target currency to Market, built from 'markets' and tagged with its 'generation'. Exchanges
+# never change a published snapshot; they build a new one and replace the reference, so readers
+# on other threads always see a consistent set of markets without taking a lock.
+class MarketSnapshot(collections.abc.Mapping):
+    def __init__(self, markets=(), generation=0):
+        self._generation = generation
+        target_markets = collections.defaultdict(dict)
+        for market in markets:
+            target_markets[market.GetSourceCurrency()][market.GetTargetCurrency()] = market
+        self._markets = {source_currency : types.MappingProxyType(markets) for
+                         (source_currency, markets) in target_markets.items()}
+
+    def __getitem__(self, source_currency):
+        return self._markets[source_currency]
+
+    def __iter__(self):
+        return iter(self._markets)
+
+    def __len__(self):
+        return len(self._markets)
+
+    # Returns the snapshot's version; a newer snapshot of the same exchange has a higher one.
+    def GetGeneration(self):
+        return self._generation
+
+    # Yields every Market in the snapshot.
+    def IterMarkets(self):
+        for target_markets in self._markets.values():
+            for market in target_markets.values():
+                yield market
+
+    # Returns whether the snapshot has a market from 'source_currency' to 'target_currency'.
+    def HasMarket(self, source_currency, target_currency):
+        return target_currency in self._markets.get(source_currency, ())
+
+    # Returns the next snapshot: this one with 'markets' added.
+    def Add(self, markets):
+        return MarketSnapshot(itertools.chain(self.IterMarkets(), markets), self._generation + 1)
+
 # A base class for Exchanges.
 class Exchange(object):
+    # The (requests per second, burst) the exchange's API allows. Subclasses override this.
+    _REQUEST_RATE = (1, 1)
+
+    def __init__(self):
+        self._rate_limiter = transport.TokenBucket(*self._REQUEST_RATE)
+        self._circuit_breaker = transport.CircuitBreaker()
+        self._request_timeout = 15
+        self._hedge_delay = 2
+        self._market_refresh_delay = 5
+        self._order_book_cache = OrderBookCache()
+        self._source_currencies = None
+        self._target_currencies = None
+        self._snapshot_path = None
+        # The current MarketSnapshot. Subclasses publish new markets by replacing it.
+        self._markets = MarketSnapshot()
+        self._tick_recorder = None
+        self._streaming = False
+        # Markets updated by pushed market data since the last WaitForMarketUpdates().
+        self._updated_markets = set()
+        self._market_updates = threading.Condition()
+        self._market_data = None
+        self._publish_market_data = False
+        # The generation of the markets last published or followed.
+        self._market_data_generation = None
+
     # Returns the name of the exchange.
     @staticmethod
     def GetName():
         raise NotImplementedError
 
+    # Returns the keys the exchange's config section must have, which are passed to the
+    # constructor as keyword arguments, e.g. ('api_key', 'api_secret').
+    @staticmethod
+    def GetConfigKeys():
+        raise NotImplementedError
+
     # Returns a list of currencies, e.g. ['BTC', 'LTC', 'DOGE', '42'].
     def GetCurrencies(self):
         raise NotImplementedError
 
-    # Returns an array of Markets.
+    # Returns a MarketSnapshot of the available Markets.
     def GetMarkets(self):
-        raise NotImplementedError
+        if self._IsFollowingMarketData():
+            self._SyncMarketData()
+        return self._markets
+
+    # Returns a counter that changes whenever markets are added to or removed from GetMarkets().
+    def GetMarketsGeneration(self):
+        return self.GetMarkets().GetGeneration()
 
     # Returns a dict of currency to balance, e.g.
     # {
@@ -89,3 +513,223 @@ class Exchange(object):
     # }
     def GetBalances(self):
         raise NotImplementedError
+
+    # Returns the PriceStore holding the price history of this exchange's markets, or None if
+    # the exchange doesn't track prices.
+    def GetPriceStore(self):
+        return None
+
+    # Returns the TokenBucket that every request to this exchange has to go through.
+    def GetRateLimiter(self):
+        return self._rate_limiter
+
+    # Returns the CircuitBreaker tracking whether this exchange's API is healthy.
+    def GetCircuitBreaker(self):
+        return self._circuit_breaker
+
+    # Sets how long, in seconds, to wait for a response before a request fails.
+    def SetRequestTimeout(self, timeout):
+        self._request_timeout = timeout
+
+    # Sets after how many seconds without a response hedged requests are sent again, or disables
+    # hedging if 'hedge_delay' is 0.
+    def SetHedgeDelay(self, hedge_delay):
+        self._hedge_delay = hedge_delay
+
+    # Sends a request for the API method 'method' by calling 'send', a function taking a timeout
+    # in seconds and returning the response, e.g. through transport.HTTPRequest. The request goes
+    # through the circuit breaker and the rate limiter, ahead of other requests if it's a
+    # 'priority' one, e.g. a market data refresh. Requests that are idempotent reads may be
+    # 'hedged': if the response is slow, 'send' is called again and the first response is used.
+    def _SendRequest(self, method, send, hedged=False, priority=False):
+        probe = self._circuit_breaker.Check(self.GetName())
+        self._rate_limiter.Acquire(priority)
+        try:
+            with metrics.Timer(metrics.REQUEST_SECONDS, (self.GetName(), method),
+                               metrics.REQUEST_ERRORS):
+                if hedged and self._hedge_delay:
+                    response = transport.HedgedCall(
+                        send, self._hedge_delay, self._request_timeout,
+                        lambda: self._OnHedge(method, priority))
+                else:
+                    response = send(self._request_timeout)
+        except ExchangeException:
+            if self._circuit_breaker.RecordFailure(probe):
+                metrics.CIRCUIT_OPENS.Increment((self.GetName(),))
+            raise
+        except Exception:
+            # Not a failure of the exchange, so it doesn't count toward the circuit.
+            if probe:
+                self._circuit_breaker.CancelProbe()
+            raise
+        self._circuit_breaker.RecordSuccess()
+        return response
+
+    def _OnHedge(self, method, priority):
+        metrics.HEDGED_REQUESTS.Increment((self.GetName(), method))
+        self._rate_limiter.Acquire(priority)
+
+    # Sets how often, in seconds, exchanges that refresh market data in the background do so.
+    def SetMarketRefreshDelay(self, delay):
+        self._market_refresh_delay = delay
+
+    # Returns the OrderBookCache shared by this exchange's markets.
+    def GetOrderBookCache(self):
+        return self._order_book_cache
+
+    # Returns the JSON-serializable market metadata to store in this exchange's snapshot.
+    def _GetSnapshotMetadata(self):
+        raise NotImplementedError
+
+    # Writes this exchange's snapshot, if it has a snapshot path. Snapshots only speed up the
+    # next startup, so failing to write one isn't an error.
+    def _SaveSnapshot(self):
+        if self._snapshot_path is None:
+            return
+        try:
+            WriteSnapshot(self._snapshot_path, self._GetSnapshotMetadata(), self.GetPriceStore())
+        except (IOError, OSError):
+            pass
+
+    # Returns the (time, metadata, arrays) of this exchange's snapshot, or None if it has no
+    # snapshot path or the snapshot can't be read.
+    def _ReadSnapshot(self):
+        if self._snapshot_path is None:
+            return None
+        try:
+            return ReadSnapshot(self._snapshot_path)
+        except (IOError, OSError, ValueError, LookupError, struct.error):
+            return None
+
+    # Shares the exchange's public market data through 'market_data', a
+    # shared_market_data.SharedMarketData. With 'publish' set the exchange fetches market data as
+    # usual and publishes it; otherwise it follows the market data published by another process
+    # instead of fetching its own.
+    def _SetMarketData(self, market_data, publish):
+        self._market_data = market_data
+        self._publish_market_data = publish
+        self._order_book_cache = market_data.GetOrderBookCache()
+
+    def _IsFollowingMarketData(self):
+        return self._market_data is not None and not self._publish_market_data
+
+    # Replaces the markets with those described by 'metadata', as returned by
+    # _GetSnapshotMetadata().
+    def _ApplyMarketMetadata(self, metadata):
+        raise NotImplementedError
+
+    # Picks up the markets published since the last call, when following market data.
+    def _SyncMarketData(self):
+        generation = self._market_data.GetGeneration()
+        if generation != self._market_data_generation:
+            self._ApplyMarketMetadata(self._market_data.GetMetadata())
+            self._market_data_generation = generation
+
+    # Publishes the markets, when publishing market data and they changed since the last call.
+    def _PublishMarketData(self):
+        if not self._publish_market_data:
+            return
+        generation = self._markets.GetGeneration()
+        if generation != self._market_data_generation:
+            self._market_data.Publish(self._GetSnapshotMetadata())
+            self._market_data_generation = generation
+
+    # Returns whether the exchange records market data to a tick recorder set with
+    # SetTickRecorder. Exchanges that do override this.
+    def RecordsTicks(self):
+        return False
+
+    # Makes the exchange record the market data it fetches to 'tick_recorder', a
+    # tick_log.TickRecorder.
+    def SetTickRecorder(self, tick_recorder):
+        self._tick_recorder = tick_recorder
+
+    # Subscribes to market data pushed over 'stream', a MarketDataStream, on a background thread.
+    # Pushed order books go straight into the exchange's OrderBookCache, pushed prices are
+    # recorded by _OnPriceUpdate, and while the stream is up the exchange polls less for market
+    # data. When
+    # the stream drops, polling takes over again until it reconnects, 'reconnect_delay' seconds
+    # later. Exchanges following another process's market data ignore this; the publishing
+    # process streams for them.
+    def Subscribe(self, stream, reconnect_delay=5):
+        if self._IsFollowingMarketData():
+            return
+        thread = threading.Thread(target=self._StreamLoop, args=(stream, reconnect_delay))
+        thread.daemon = True
+        thread.start()
+
+    # Returns whether pushed market data is arriving.
+    def IsStreaming(self):
+        return self._streaming
+
+    def _StreamLoop(self, stream, reconnect_delay):
+        while True:
+            try:
+                for update in stream.IterUpdates():
+                    self._streaming = True
+                    self._ApplyStreamUpdate(update)
+            except ExchangeException:
+                pass
+            self._streaming = False
+            time.sleep(reconnect_delay)
+
+    def _ApplyStreamUpdate(self, update):
+        try:
+            if update.get('type') == 'price':
+                markets = self._OnPriceUpdate(update['source'], update['target'],
+                                              float(update['last_trade']),
+                                              float(update['day_max_price']))
+            elif update.get('type') == 'order_book':
+                (bids, asks) = (update.get('bids') or [], update.get('asks') or [])
+                markets = self._OnOrderBookUpdate(update['source'], update['target'], OrderBook(
+                    [float(price) for (price, _) in bids], [float(amount) for (_, amount) in bids],
+                    [float(price) for (price, _) in asks], [float(amount) for (_, amount) in asks]))
+            else:
+                return
+        except (TypeError, LookupError, ValueError, AttributeError):
+            return  # skip malformed updates
+        self._NotifyMarketUpdates(markets)
+
+    # Wakes WaitForMarketUpdates() callers for the Markets in 'markets', if any.
+    def _NotifyMarketUpdates(self, markets):
+        if markets:
+            with self._market_updates:
+                self._updated_markets.update(markets)
+                self._market_updates.notify_all()
+
+    # Handles a pushed last trade and day's max price of the market from 'source_currency' to
+    # 'target_currency'. Returns the Markets whose prices changed. Exchanges that keep a
+    # PriceStore override this.
+    def _OnPriceUpdate(self, source_currency, target_currency, last_trade, day_max_price):
+        return []
+
+    # Caches a pushed order book of the market from 'source_currency' to 'target_currency'.
+    # Returns the Markets it belongs to.
+    def _OnOrderBookUpdate(self, source_currency, target_currency, order_book):
+        market = self._markets.get(source_currency, {}).get(target_currency)
+        if market is None:
+            return []
+        self._order_book_cache.Put(market._GetOrderBookKey(), order_book)
+        return [market]
+
+    # Waits up to 'timeout' seconds for pushed market data, and returns the set of Markets it
+    # updated since the last call (empty if none arrived).
+    def WaitForMarketUpdates(self, timeout):
+        with self._market_updates:
+            if not self._updated_markets:
+                self._market_updates.wait(timeout)
+            (updated_markets, self._updated_markets) = (self._updated_markets, set())
+        return updated_markets
+
+    # Restricts market data refreshes to markets that sell one of 'source_currencies' (or any
+    # currency, if empty) for one of 'target_currencies'.
+    def SetCurrencyFilter(self, source_currencies, target_currencies):
+        self._source_currencies = set(source_currencies)
+        self._target_currencies = set(target_currencies)
+
+    # Returns whether the market from 'source_currency' to 'target_currency' passes the filter.
+    def _IsRelevantMarket(self, source_currency, target_currency):
+        if self._target_currencies is None:
+            return True
+        return (target_currency in self._target_currencies and
+                (not self._source_currencies or source_currency in self._source_currencies))
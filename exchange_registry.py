@@ -0,0 +1,30 @@
+# The exchanges the script supports. Each exchange is registered with the module implementing it,
+# which is only imported once the exchange is used, so that startup only pays for the exchanges
+# that are configured.
+
+import collections
+import importlib
+
+_exchanges = collections.OrderedDict()
+
+# Registers the exchange called 'name', implemented by the Exchange subclass 'class_name' of the
+# module 'module_name'.
+def Register(name, module_name, class_name):
+    _exchanges[name] = (module_name, class_name)
+
+# Returns the names of all registered exchanges, in registration order.
+def GetNames():
+    return list(_exchanges.keys())
+
+# Imports the module of the exchange called 'name', if it wasn't yet, and returns its Exchange
+# subclass.
+def GetExchangeClass(name):
+    (module_name, class_name) = _exchanges[name]
+    exchange_class = getattr(importlib.import_module(module_name), class_name)
+    if exchange_class.GetName() != name:
+        raise ValueError('%s.%s is called %s, not %s.' % (module_name, class_name,
+                                                          exchange_class.GetName(), name))
+    return exchange_class
+
+Register('CoinEx', 'coinex_api', 'CoinEx')
+Register('Cryptsy', 'cryptsy_api', 'Cryptsy')
@@ -0,0 +1,134 @@
+# Log output formatted and written on a background thread, so that the polling loops never wait
+# on stdout.
+#
+# Messages go through a bounded queue. When the writer falls behind, new messages are dropped and
+# counted instead of blocking the caller, and the count is logged once the writer catches up.
+# Lines are written as text or, for log ingestion, as JSON lines.
+
+import json
+import metrics
+import os
+import queue
+import sys
+import threading
+import time
+
+# The writer writes at most this many queued messages at once.
+_MAX_BATCH = 1024
+
+class LogPipeline(object):
+    # 'output' is the file to write to, sys.stdout by default. At most 'max_queued' messages wait
+    # to be written; LogSampled logs at most one message per key every 'sample_interval' seconds.
+    def __init__(self, output=None, json_lines=False, max_queued=10000, sample_interval=60):
+        self._output = output
+        self._json_lines = json_lines
+        self._max_queued = max_queued
+        self._sample_interval = sample_interval
+        self._last_sampled = {}
+        self._time_second = None
+        self._time_text = None
+        self._Start()
+        if hasattr(os, 'register_at_fork'):
+            # Don't fork while the writer holds the output's lock, and give the child its own
+            # writer.
+            os.register_at_fork(before=self._AcquireWriteLock,
+                                after_in_parent=self._ReleaseWriteLock,
+                                after_in_child=self._Start)
+
+    def _Start(self):
+        self._messages = queue.Queue(self._max_queued)
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        thread = threading.Thread(target=self._WriteLoop, name='log')
+        thread.daemon = True
+        thread.start()
+
+    def _AcquireWriteLock(self):
+        self._write_lock.acquire()
+
+    def _ReleaseWriteLock(self):
+        self._write_lock.release()
+
+    def SetJSONLines(self, json_lines):
+        self._json_lines = json_lines
+
+    def SetSampleInterval(self, sample_interval):
+        self._sample_interval = sample_interval
+
+    # Queues 'message' % 'args' to be written. Never blocks: if the queue is full, the message
+    # is dropped.
+    def Log(self, message, *args):
+        try:
+            self._messages.put_nowait((time.time(), threading.current_thread().name, message,
+                                       args))
+        except queue.Full:
+            with self._dropped_lock:
+                self._dropped += 1
+            metrics.LOG_MESSAGES_DROPPED.Increment()
+
+    # Like Log, but only logs if no message was logged for 'key' in the last sample_interval
+    # seconds. For verbose messages that would otherwise be logged for every market every cycle.
+    def LogSampled(self, key, message, *args):
+        now = time.time()
+        last_sampled = self._last_sampled.get(key)
+        if last_sampled is not None and now - last_sampled < self._sample_interval:
+            return
+        self._last_sampled[key] = now
+        self.Log(message, *args)
+
+    # Waits up to 'timeout' seconds for the messages queued so far to be written.
+    def Flush(self, timeout=5):
+        written = threading.Event()
+        try:
+            self._messages.put(written, timeout=timeout)
+        except queue.Full:
+            return
+        written.wait(timeout)
+
+    def _Format(self, timestamp, thread_name, message, args):
+        try:
+            text = message % args
+        except (TypeError, ValueError):
+            text = '%s %r' % (message, args)
+        if self._json_lines:
+            return json.dumps({'time' : timestamp, 'thread' : thread_name,
+                               'message' : text}) + '\n'
+        # Formatting the time is comparatively slow, so it's done once per second.
+        second = int(timestamp)
+        if second != self._time_second:
+            self._time_second = second
+            self._time_text = time.strftime('%c', time.localtime(second))
+        return '%s: %s\n' % (self._time_text, text)
+
+    def _WriteLoop(self):
+        while True:
+            entries = [self._messages.get()]
+            try:
+                while len(entries) < _MAX_BATCH:
+                    entries.append(self._messages.get_nowait())
+            except queue.Empty:
+                pass
+
+            lines = []
+            flushes = []
+            for entry in entries:
+                if isinstance(entry, threading.Event):
+                    flushes.append(entry)
+                else:
+                    lines.append(self._Format(*entry))
+            with self._dropped_lock:
+                (dropped, self._dropped) = (self._dropped, 0)
+            if dropped:
+                lines.append(self._Format(time.time(), threading.current_thread().name,
+                                          'Dropped %d log messages.', (dropped,)))
+
+            with self._write_lock:
+                output = self._output or sys.stdout
+                try:
+                    output.write(''.join(lines))
+                    output.flush()
+                except (IOError, ValueError):
+                    pass  # nowhere left to report it
+            for written in flushes:
+                written.set()
@@ -0,0 +1,170 @@
+# Low-overhead counters and latency histograms for the hot paths, exposed over a local HTTP
+# endpoint in the Prometheus text format.
+
+import bisect
+import http.server
+import socketserver
+import threading
+import time
+
+_metrics = []
+
+def _FormatLabels(label_names, labels, extra=()):
+    pairs = list(zip(label_names, labels)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                                          .replace('"', '\\"'))
+                             for name, value in pairs)
+
+# A monotonically increasing count, kept per combination of label values.
+class Counter(object):
+    def __init__(self, name, description, label_names=()):
+        self._name = name
+        self._description = description
+        self._label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    # Adds 'amount' to the count for 'labels', a tuple of values for the label names.
+    def Increment(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _Render(self, lines):
+        lines.append('# HELP %s %s' % (self._name, self._description))
+        lines.append('# TYPE %s counter' % self._name)
+        with self._lock:
+            values = sorted(self._values.items())
+        for (labels, value) in values:
+            lines.append('%s%s %s' % (self._name, _FormatLabels(self._label_names, labels), value))
+
+# A distribution of observed values, e.g. latencies in seconds, kept as cumulative bucket counts
+# per combination of label values.
+class Histogram(object):
+    _DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, description, label_names=(), buckets=_DEFAULT_BUCKETS):
+        self._name = name
+        self._description = description
+        self._label_names = label_names
+        self._buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    # Records 'value' for 'labels', a tuple of values for the label names.
+    def Observe(self, value, labels=()):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of the values.
+                values = self._values[labels] = [0] * (len(self._buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += value
+
+    # Returns the number and the sum of the values observed for 'labels'.
+    def GetTotals(self, labels=()):
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                return (0, 0.0)
+            return (sum(values[:-1]), values[-1])
+
+    def _Render(self, lines):
+        lines.append('# HELP %s %s' % (self._name, self._description))
+        lines.append('# TYPE %s histogram' % self._name)
+        with self._lock:
+            values = sorted((labels, list(counts)) for labels, counts in self._values.items())
+        for (labels, counts) in values:
+            total = 0
+            for (bucket, count) in zip(self._buckets + ('+Inf',), counts):
+                total += count
+                lines.append('%s_bucket%s %d' % (self._name, _FormatLabels(
+                    self._label_names, labels, [('le', bucket)]), total))
+            label_string = _FormatLabels(self._label_names, labels)
+            lines.append('%s_sum%s %s' % (self._name, label_string, counts[-1]))
+            lines.append('%s_count%s %d' % (self._name, label_string, total))
+
+# Context manager that observes how long its block took in 'histogram' and, if the block
+# raises, counts the exception's type in 'errors' (if given), e.g.
+#   with metrics.Timer(metrics.REQUEST_SECONDS, (name, method), metrics.REQUEST_ERRORS):
+#       ...
+class Timer(object):
+    def __init__(self, histogram, labels=(), errors=None):
+        self._histogram = histogram
+        self._labels = labels
+        self._errors = errors
+
+    def __enter__(self):
+        self._start_time = time.time()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self._histogram.Observe(time.time() - self._start_time, self._labels)
+        if exception is not None and self._errors is not None:
+            self._errors.Increment(self._labels + (GetErrorType(exception),))
+        return False
+
+# Returns the name of the exception type behind 'exception', looking through the
+# ExchangeException wrapper.
+def GetErrorType(exception):
+    return getattr(exception, 'exception_type', type(exception).__name__)
+
+# Returns all metrics in the Prometheus text exposition format.
+def Render():
+    lines = []
+    for metric in _metrics:
+        metric._Render(lines)
+    return '\n'.join(lines) + '\n'
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = Render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+# Serves the metrics at http://<address>:<port>/metrics on a background thread.
+def StartServer(port, address='127.0.0.1'):
+    server = _ThreadingHTTPServer((address, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+REQUEST_SECONDS = Histogram('autosell_request_seconds', 'Exchange API request latency.',
+                            ('exchange', 'method'))
+REQUEST_ERRORS = Counter('autosell_request_errors_total', 'Failed exchange API requests.',
+                         ('exchange', 'method', 'type'))
+MARKET_REFRESH_SECONDS = Histogram('autosell_market_refresh_seconds',
+                                   'Duration of background market price refreshes.',
+                                   ('exchange',))
+CYCLE_SECONDS = Histogram('autosell_cycle_seconds', 'Duration of one polling cycle.',
+                          ('exchange',))
+STAGE_SECONDS = Histogram('autosell_stage_seconds', 'Time spent in each stage of polling cycles.',
+                          ('exchange', 'stage'))
+ORDERS = Counter('autosell_orders_total', 'Sell orders created.', ('exchange',))
+FAILURES = Counter('autosell_failures_total', 'Failures in the polling cycle.',
+                   ('exchange', 'stage', 'type'))
+CIRCUIT_OPENS = Counter('autosell_circuit_opens_total',
+                        'Times an exchange failed often enough to stop sending it requests.',
+                        ('exchange',))
+HEDGED_REQUESTS = Counter('autosell_hedged_requests_total',
+                          'Requests sent again because the first attempt was slow.',
+                          ('exchange', 'method'))
+LOG_MESSAGES_DROPPED = Counter('autosell_log_messages_dropped_total',
+                               'Log messages dropped because the log writer fell behind.')
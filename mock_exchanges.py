@@ -0,0 +1,238 @@
+#!/usr/bin/python
+
+# Local stand-ins for the CoinEx and Cryptsy HTTP APIs, used by benchmark.py to drive
+# altcoin-autosell.py without touching real exchanges, and for a pushed market data stream.
+
+import http.server
+import itertools
+import json
+import socket
+import socketserver
+import threading
+import time
+import urllib.parse
+
+# Records the requests a mock exchange served, for computing per-cycle statistics.
+class RequestLog(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = []
+
+    def Add(self, method):
+        with self._lock:
+            self._requests.append((time.time(), method))
+
+    # Returns a list of (time, method) tuples in the order they were served.
+    def GetRequests(self):
+        with self._lock:
+            return list(self._requests)
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class _MockHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _Reply(self, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _ReadBody(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def _Serve(self, method, handler, *args):
+        mock = self.server.mock
+        mock.request_log.Add(method)
+        if mock.latency:
+            time.sleep(mock.latency)
+        response = handler(*args)
+        if response is None:
+            self.send_error(404)
+        else:
+            self._Reply(response)
+
+# Base class for the mock exchanges. 'market_count' altcoins (ALT0, ALT1, ...) are listed, each
+# with a market to BTC; 'latency' seconds are added to every response.
+class MockExchange(object):
+    def __init__(self, market_count=10, latency=0, port=0):
+        self.market_count = market_count
+        self.latency = latency
+        self.request_log = RequestLog()
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port), self._HANDLER)
+        self._server.mock = self
+        self._order_ids = itertools.count(1)
+        self._order_lock = threading.Lock()
+
+    def GetAltcoins(self):
+        return ['ALT%d' % i for i in range(self.market_count)]
+
+    def GetPort(self):
+        return self._server.server_address[1]
+
+    def _NextOrderId(self):
+        with self._order_lock:
+            return next(self._order_ids)
+
+    def Start(self):
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def Stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+class _CoinExHandler(_MockHandler):
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        method = url.path.rsplit('/', 1)[-1]
+        query = urllib.parse.parse_qs(url.query)
+        mock = self.server.mock
+        handlers = {'currencies' : mock._Currencies,
+                    'trade_pairs' : mock._TradePairs,
+                    'balances' : mock._Balances,
+                    'orders' : lambda: mock._Orders(int(query.get('tradePair', ['0'])[0]))}
+        self._Serve(method, handlers.get(method, lambda: None))
+
+    def do_POST(self):
+        method = urllib.parse.urlsplit(self.path).path.rsplit('/', 1)[-1]
+        body = self._ReadBody()
+        mock = self.server.mock
+        if method == 'orders':
+            self._Serve('create_order', mock._CreateOrder, json.loads(body))
+        else:
+            self._Serve(method, lambda: None)
+
+# Speaks the CoinEx v2 'currencies', 'trade_pairs', 'balances' and 'orders' endpoints under
+# http://127.0.0.1:<port>/api/v2/. Currency id 1 is BTC, 2 is LTC and altcoins follow.
+class MockCoinEx(MockExchange):
+    _HANDLER = _CoinExHandler
+
+    def GetApiUrl(self):
+        return 'http://127.0.0.1:%d/api/v2/' % self.GetPort()
+
+    def _Currencies(self):
+        names = ['BTC', 'LTC'] + self.GetAltcoins()
+        return {'currencies' : [{'id' : i + 1, 'name' : name} for i, name in enumerate(names)]}
+
+    def _TradePairs(self):
+        return {'trade_pairs' : [{'id' : i + 1, 'currency_id' : i + 3, 'market_id' : 1} for
+                                 i in range(self.market_count)]}
+
+    def _Balances(self):
+        return {'balances' : [{'currency_id' : i + 3, 'amount' : 5} for
+                              i in range(self.market_count)]}
+
+    def _Orders(self, trade_pair_id):
+        return {'orders' : [{'id' : trade_pair_id * 10 + i, 'bid' : i % 2 == 0,
+                             'amount' : 100000000, 'rate' : 1000 + i} for i in range(10)]}
+
+    def _CreateOrder(self, request):
+        return {'order' : {'id' : self._NextOrderId()}}
+
+class _CryptsyHandler(_MockHandler):
+    def do_POST(self):
+        post_dict = dict(urllib.parse.parse_qsl(self._ReadBody()))
+        method = post_dict.get('method', '')
+        mock = self.server.mock
+        handlers = {'getmarkets' : mock._GetMarkets,
+                    'getinfo' : mock._GetInfo,
+                    'marketorders' : mock._MarketOrders,
+                    'createorder' : mock._CreateOrder}
+        self._Serve(method, handlers.get(method, lambda: None))
+
+# Speaks the Cryptsy 'getmarkets', 'getinfo', 'marketorders' and 'createorder' methods at
+# http://127.0.0.1:<port>/api. Prices hold steady at half the day's high, so that once a market
+# has two price refreshes its tiny balance passes the sell check.
+class MockCryptsy(MockExchange):
+    _HANDLER = _CryptsyHandler
+
+    def GetApiUrl(self):
+        return 'http://127.0.0.1:%d/api' % self.GetPort()
+
+    def _GetMarkets(self):
+        return {'success' : 1,
+                'return' : [{'marketid' : i + 1, 'label' : '%s/BTC' % currency,
+                             'primary_currency_code' : currency,
+                             'secondary_currency_code' : 'BTC',
+                             'last_trade' : '0.00001000', 'high_trade' : '0.00002000'} for
+                            i, currency in enumerate(self.GetAltcoins())]}
+
+    def _GetInfo(self):
+        return {'success' : 1,
+                'return' : {'balances_available' : {currency : '0.00000005' for
+                                                    currency in self.GetAltcoins()}}}
+
+    def _MarketOrders(self):
+        return {'success' : 1,
+                'return' : {'buyorders' : [{'buyprice' : '%.8f' % (0.00001 - i * 1e-7),
+                                            'quantity' : '100'} for i in range(10)],
+                            'sellorders' : [{'sellprice' : '%.8f' % (0.00001 + i * 1e-7),
+                                             'quantity' : '100'} for i in range(10)]}}
+
+    def _CreateOrder(self):
+        return {'success' : 1, 'orderid' : self._NextOrderId()}
+
+class _StreamHandler(_MockHandler):
+    def do_GET(self):
+        mock = self.server.mock
+        if urllib.parse.urlsplit(self.path).path != '/stream':
+            self.send_error(404)
+            return
+        mock.request_log.Add('stream')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for line in mock._IterLines():
+                self.wfile.write(line)
+                self.wfile.flush()
+        except socket.error:
+            pass  # the client went away
+
+# Pushes market data for the Cryptsy mock's markets (ALT0/BTC, ALT1/BTC, ...) as JSON lines at
+# http://127.0.0.1:<port>/stream, in the format exchange_api.JSONLinesStream reads: every
+# 'interval' seconds, a price and an order book update for each market. Prices match
+# MockCryptsy's.
+class MockStream(MockExchange):
+    _HANDLER = _StreamHandler
+
+    def __init__(self, market_count=10, interval=0.5, port=0):
+        MockExchange.__init__(self, market_count, 0, port)
+        self.interval = interval
+        self._generation = 0
+
+    def GetStreamUrl(self):
+        return 'http://127.0.0.1:%d/stream' % self.GetPort()
+
+    # Closes all open streams, as a feed outage would; clients may reconnect.
+    def DropConnections(self):
+        self._generation += 1
+
+    def Stop(self):
+        self.DropConnections()
+        MockExchange.Stop(self)
+
+    def _IterLines(self):
+        generation = self._generation
+        while generation == self._generation:
+            for currency in self.GetAltcoins():
+                yield self._Line({'type' : 'price', 'source' : currency, 'target' : 'BTC',
+                                  'last_trade' : 0.00001, 'day_max_price' : 0.00002})
+                yield self._Line({'type' : 'order_book', 'source' : currency, 'target' : 'BTC',
+                                  'bids' : [[0.00001 - i * 1e-7, 100] for i in range(10)],
+                                  'asks' : [[0.00001 + i * 1e-7, 100] for i in range(10)]})
+            time.sleep(self.interval)
+
+    def _Line(self, update):
+        return (json.dumps(update) + '\n').encode('utf-8')
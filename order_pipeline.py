@@ -0,0 +1,97 @@
+# Places sell orders concurrently, so that when many currencies trigger at once the last one
+# isn't sold long after the first.
+
+import exchange_api
+import metrics
+import queue
+import threading
+import traceback
+
+# The outcome of selling a balance. On success 'order' is set; otherwise 'stage' says what
+# failed ('order_book', 'no_bids' or 'create_order') and 'error' holds the ExchangeException,
+# if any. Unexpected errors have the stage 'error'. 'market' and 'price' are those of the last
+# market tried.
+class SellResult(object):
+    def __init__(self, market, amount, price=None, order=None, stage=None, error=None):
+        self.market = market
+        self.amount = amount
+        self.price = price
+        self.order = order
+        self.stage = stage
+        self.error = error
+
+# Sells balances on one exchange using 'max_in_flight' worker threads. Requests still go through
+# the exchange's rate limiter. Every attempt, failed or not, is passed to 'report' as a
+# SellResult, on the worker thread that made it.
+class OrderPipeline(object):
+    def __init__(self, max_in_flight, report):
+        self._report = report
+        self._intents = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        for _ in range(max_in_flight):
+            thread = threading.Thread(target=self._Work)
+            thread.daemon = True
+            thread.start()
+
+    # Queues a sale of 'amount' of the markets' source currency into the first of 'markets' that
+    # has buy orders. Returns False, without queueing, if a sale of that currency is still
+    # pending.
+    def Submit(self, markets, amount):
+        currency = markets[0].GetSourceCurrency()
+        with self._lock:
+            if currency in self._pending:
+                return False
+            self._pending.add(currency)
+        self._intents.put((currency, markets, amount))
+        return True
+
+    # Blocks until every submitted sale has been attempted.
+    def Join(self):
+        self._intents.join()
+
+    def _Work(self):
+        while True:
+            (currency, markets, amount) = self._intents.get()
+            market = markets[0]
+            try:
+                for result in self._Sell(markets, amount):
+                    market = result.market
+                    self._Report(result)
+            except Exception as e:
+                # Keep the worker alive, or sales would queue up with nobody to make them.
+                self._Report(SellResult(market, amount, stage='error', error=e))
+            finally:
+                with self._lock:
+                    self._pending.discard(currency)
+                self._intents.task_done()
+
+    # Passes 'result' to 'report'. An error there is printed rather than ending the worker.
+    def _Report(self, result):
+        try:
+            self._report(result)
+        except Exception:
+            traceback.print_exc()
+
+    # Yields a SellResult for each market tried. Markets without buy orders are skipped, and no
+    # further markets are tried once an order was attempted.
+    def _Sell(self, markets, amount):
+        for market in markets:
+            exchange_name = market.GetExchange().GetName()
+            try:
+                with metrics.Timer(metrics.STAGE_SECONDS, (exchange_name, 'order_book')):
+                    price = market.GetBestBid()
+            except exchange_api.ExchangeException as e:
+                yield SellResult(market, amount, stage='order_book', error=e)
+                continue
+            if price is None:
+                yield SellResult(market, amount, stage='no_bids')
+                continue
+
+            try:
+                with metrics.Timer(metrics.STAGE_SECONDS, (exchange_name, 'create_order')):
+                    order = market.CreateOrder(False, amount, price)
+                yield SellResult(market, amount, price, order=order)
+            except exchange_api.ExchangeException as e:
+                yield SellResult(market, amount, price, stage='create_order', error=e)
+            return
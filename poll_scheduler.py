@@ -0,0 +1,64 @@
+# Decides when each market of an exchange is next worth evaluating, so that the exchange's
+# request budget goes to markets that are about to trigger a sell.
+class PollScheduler(object):
+    def __init__(self, poll_delay, fast_poll_delay):
+        self._poll_delay = poll_delay
+        self._fast_poll_delay = fast_poll_delay
+        self._next_due = {}
+
+    # Returns whether 'market' should be evaluated at time 'now'. Markets that were never
+    # evaluated are always due.
+    def IsDue(self, market, now):
+        return self._next_due.get(market, now) <= now
+
+    # Records that 'market' was evaluated at time 'now'. Markets that are 'near_trigger' are
+    # due again after fast_poll_delay seconds, others after poll_delay seconds.
+    def Reschedule(self, market, now, near_trigger):
+        self._next_due[market] = now + (self._fast_poll_delay if near_trigger else
+                                        self._poll_delay)
+
+    # Makes 'market' due right away, e.g. because new market data was pushed for it.
+    def MarkDue(self, market):
+        self._next_due.pop(market, None)
+
+    # Forgets about markets not in 'markets', e.g. because their balance was sold.
+    def Prune(self, markets):
+        for market in list(self._next_due):
+            if market not in markets:
+                del self._next_due[market]
+
+    # Returns the time at which the next market falls due, given it's now 'now'.
+    def GetNextDue(self, now):
+        if not self._next_due:
+            return now + self._poll_delay
+        return min(self._next_due.values())
+
+# Remembers the balance and price version each market was last evaluated with, so that markets
+# where neither changed since can skip evaluation.
+class ChangeTracker(object):
+    def __init__(self):
+        self._evaluated = {}
+
+    # Returns the state of 'market' with 'balance', to pass to HasChanged and MarkClean.
+    def GetState(self, market, balance):
+        return (balance, market.GetPriceVersion())
+
+    # Returns whether 'market' is in a different 'state' than when it was last marked clean.
+    def HasChanged(self, market, state):
+        evaluated = self._evaluated.get(market)
+        return evaluated is None or evaluated[0] != state
+
+    # Records that 'market' was evaluated in 'state' and didn't need a sell, along with whether
+    # it was 'near_trigger'.
+    def MarkClean(self, market, state, near_trigger):
+        self._evaluated[market] = (state, near_trigger)
+
+    # Returns whether 'market' was near a trigger when it was last marked clean.
+    def WasNearTrigger(self, market):
+        return self._evaluated[market][1]
+
+    # Forgets about markets not in 'markets'.
+    def Prune(self, markets):
+        for market in list(self._evaluated):
+            if market not in markets:
+                del self._evaluated[market]
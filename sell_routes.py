@@ -0,0 +1,50 @@
+# Precomputed sell routes: for each source currency, the Markets its balance may be sold into,
+# in target priority order.
+class RouteIndex(object):
+    def __init__(self, target_currencies, source_currencies):
+        self._target_currencies = list(target_currencies)
+        self._target_priorities = {currency : index for
+                                   index, currency in enumerate(target_currencies)}
+        self._source_currencies = set(source_currencies)
+        self._generation = None
+        self._known_markets = {}
+        self._routes = {}
+
+    # Returns whether a balance of 'source_currency' may be sold for 'target_currency'. Target
+    # currencies are only sold for higher priority target currencies.
+    def _IsAllowed(self, source_currency, target_currency):
+        source_priority = self._target_priorities.get(source_currency)
+        return source_priority is None or self._target_priorities[target_currency] < source_priority
+
+    # Brings the index up to date with 'exchange's markets. Nothing is done unless the exchange
+    # added or removed markets since the last call, and then only the routes of source
+    # currencies whose markets changed are rebuilt.
+    def Sync(self, exchange):
+        generation = exchange.GetMarketsGeneration()
+        if generation == self._generation:
+            return
+        self._generation = generation
+
+        markets = exchange.GetMarkets()
+        for source_currency in list(self._known_markets):
+            if source_currency not in markets:
+                del self._known_markets[source_currency]
+                self._routes.pop(source_currency, None)
+        for (source_currency, target_markets) in list(markets.items()):
+            if self._source_currencies and source_currency not in self._source_currencies:
+                continue
+            target_markets = dict(target_markets)
+            known_markets = self._known_markets.get(source_currency)
+            if (known_markets is not None and len(known_markets) == len(target_markets) and
+                all(target_markets.get(target_currency) is market for
+                    (target_currency, market) in known_markets.items())):
+                continue
+            self._known_markets[source_currency] = target_markets
+            self._routes[source_currency] = [
+                target_markets[target_currency] for target_currency in self._target_currencies
+                if (target_currency in target_markets and
+                    self._IsAllowed(source_currency, target_currency))]
+
+    # Returns the Markets to try selling 'source_currency' into, highest priority first.
+    def GetRoutes(self, source_currency):
+        return self._routes.get(source_currency, ())
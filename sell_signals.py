@@ -0,0 +1,87 @@
+# The sell strategy: decides from a market's recent prices whether to sell a balance into it.
+#
+# A balance is sold when the market's price is above DAY_MAX_RATIO of the day's max and has been
+# flat for FLAT_TICKS price refreshes, or when it's below that and not rising.
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional; without it every market is evaluated one at a time.
+    numpy = None
+
+DAY_MAX_RATIO = .93
+FLAT_TICKS = 6
+
+# Returns whether 'balance' should be sold into a market with the given recent 'prices' (newest
+# first) and 'day_max_price'. 'day_max_ratio' and 'flat_ticks' override the strategy's
+# parameters, e.g. for backtesting.
+def ShouldSell(prices, day_max_price, balance, trade_minimum, day_max_ratio=DAY_MAX_RATIO,
+               flat_ticks=FLAT_TICKS):
+    if balance < trade_minimum and prices and prices[0] > 0:
+        if prices[0] > day_max_price * day_max_ratio:
+            return all(price == prices[0] for price in prices[1:flat_ticks])
+        return prices[0] <= prices[1]
+    return False
+
+# Returns whether the price is within 'near_trigger_margin' of the day's max threshold, i.e.
+# whether a price spike could trigger a sell soon.
+def IsNearSell(prices, day_max_price, balance, trade_minimum, near_trigger_margin,
+               day_max_ratio=DAY_MAX_RATIO):
+    if balance < trade_minimum and prices and prices[0] > 0:
+        return prices[0] > day_max_price * day_max_ratio * (1 - near_trigger_margin)
+    return False
+
+def _EvaluateMarket(market, balance, near_trigger_margin, day_max_ratio, flat_ticks):
+    (prices, day_max_price) = market.GetPriceTick()
+    trade_minimum = market.GetTradeMinimum()
+    return (ShouldSell(prices, day_max_price, balance, trade_minimum, day_max_ratio, flat_ticks),
+            IsNearSell(prices, day_max_price, balance, trade_minimum, near_trigger_margin,
+                       day_max_ratio))
+
+# Evaluates the markets at 'indices' of 'candidates', which all keep their prices in
+# 'price_store', in one pass over a matrix of their price histories.
+def _EvaluatePriceStore(price_store, candidates, indices, near_trigger_margin, day_max_ratio,
+                        flat_ticks, sells, nears):
+    (prices, heads, day_max_prices) = price_store.Copy()
+    depth = price_store.GetDepth()
+    slots = numpy.array([candidates[index][0].GetPriceSlot() for index in indices])
+    balances = numpy.array([candidates[index][1] for index in indices], dtype=float)
+    trade_minimums = numpy.array([candidates[index][0].GetTradeMinimum() for index in indices],
+                                 dtype=float)
+
+    # Gather each slot's ring buffer into a row, newest price first.
+    ring_buffers = numpy.frombuffer(prices, dtype=float).reshape(-1, depth)
+    heads = numpy.frombuffer(heads, dtype=numpy.dtype(heads.typecode))[slots]
+    columns = (heads[:, None] - numpy.arange(depth)) % depth
+    history = ring_buffers[slots[:, None], columns]
+    threshold = numpy.frombuffer(day_max_prices, dtype=float)[slots] * day_max_ratio
+
+    current = history[:, 0]
+    eligible = (balances < trade_minimums) & (current > 0)
+    flat = (history[:, :flat_ticks] == current[:, None]).all(axis=1)
+    sell = eligible & numpy.where(current > threshold, flat, current <= history[:, 1])
+    near = eligible & (current > threshold * (1 - near_trigger_margin))
+    for (index, sell_flag, near_flag) in zip(indices, sell.tolist(), near.tolist()):
+        sells[index] = sell_flag
+        nears[index] = near_flag
+
+# Evaluates ShouldSell and IsNearSell for each (market, balance) tuple in 'candidates' and
+# returns a list of sell flags and a list of near-sell flags, in the same order. With NumPy,
+# markets backed by a PriceStore are evaluated together, one vectorized pass per store.
+def Evaluate(candidates, near_trigger_margin, day_max_ratio=DAY_MAX_RATIO,
+             flat_ticks=FLAT_TICKS):
+    sells = [False] * len(candidates)
+    nears = [False] * len(candidates)
+    by_price_store = {}
+    for (index, (market, balance)) in enumerate(candidates):
+        price_store = market.GetExchange().GetPriceStore()
+        if numpy is not None and price_store is not None:
+            by_price_store.setdefault(price_store, []).append(index)
+        else:
+            (sells[index], nears[index]) = _EvaluateMarket(market, balance, near_trigger_margin,
+                                                           day_max_ratio, flat_ticks)
+
+    for (price_store, indices) in by_price_store.items():
+        _EvaluatePriceStore(price_store, candidates, indices, near_trigger_margin, day_max_ratio,
+                            flat_ticks, sells, nears)
+    return (sells, nears)
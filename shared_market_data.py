@@ -0,0 +1,183 @@
+# Public market data shared between processes, for running many accounts at once: one exchange
+# instance fetches and refreshes the markets, prices and order books, and the exchange instances
+# of every other account, in other processes, read them instead of requesting them again.
+#
+# Prices live in shared memory. Market lists and order books go through a multiprocessing
+# Manager, since they change rarely or are only needed when selling.
+
+import array
+import ctypes
+import exchange_api
+import multiprocessing.managers
+import os
+import threading
+import time
+import transport
+
+# Starts a thread that ends the calling process once its parent process is gone, so that the
+# processes sharing market data don't outlive a supervisor that was killed.
+def ExitWithParent():
+    parent = os.getppid()
+    def Watch():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(1)
+    thread = threading.Thread(target=Watch)
+    thread.daemon = True
+    thread.start()
+
+# Starts the Manager process that SharedMarketData needs, from 'context'.
+def StartManager(context):
+    manager = multiprocessing.managers.SyncManager(ctx=context)
+    manager.start(ExitWithParent)
+    return manager
+
+# A PriceStore in shared memory, with room for 'capacity' market slots. Create it before forking
+# the processes that share it.
+class SharedPriceStore(exchange_api.PriceStore):
+    def __init__(self, context, capacity, depth=6, initial_price=-1):
+        exchange_api.PriceStore.__init__(self, depth, initial_price)
+        self._capacity = capacity
+        self._prices = context.RawArray('d', [initial_price] * (capacity * depth))
+        self._heads = context.RawArray('l', capacity)
+        self._day_max_prices = context.RawArray('d', capacity)
+        self._versions = context.RawArray('L', capacity)
+        self._slot_count = context.RawValue('l', 0)
+        self._lock = context.Lock()
+
+    def AddSlot(self):
+        with self._lock:
+            slot = self._slot_count.value
+            if slot >= self._capacity:
+                raise exchange_api.ExchangeException(
+                    IndexError('Shared price store is full (%d slots).' % self._capacity))
+            self._slot_count.value = slot + 1
+            return slot
+
+    def _GetRing(self, slot):
+        start = slot * self._depth
+        ring = self._prices[start:start + self._depth]
+        head = self._heads[slot]
+        return ring[head::-1] + ring[:head:-1]
+
+    def Copy(self):
+        with self._lock:
+            slot_count = self._slot_count.value
+            return tuple(_CopyArray(typecode, values, length) for (typecode, values, length) in
+                         (('d', self._prices, slot_count * self._depth),
+                          ('l', self._heads, slot_count),
+                          ('d', self._day_max_prices, slot_count)))
+
+    def Restore(self, prices, heads, day_max_prices):
+        if len(prices) != len(heads) * self._depth or len(day_max_prices) != len(heads):
+            raise ValueError('Inconsistent price store arrays.')
+        if len(heads) > self._capacity:
+            raise ValueError('Too many slots for the shared price store.')
+        with self._lock:
+            self._prices[:len(prices)] = prices
+            self._heads[:len(heads)] = heads
+            self._day_max_prices[:len(day_max_prices)] = day_max_prices
+            self._versions[:len(heads)] = [0] * len(heads)
+            self._slot_count.value = len(heads)
+
+# A NonceCounter in shared memory, for an API key that several processes sign requests with.
+# Create it before forking the processes that share it.
+class SharedNonceCounter(transport.NonceCounter):
+    def __init__(self, context):
+        transport.NonceCounter.__init__(self)
+        self._shared_nonce = context.RawValue('l', 0)
+        self._lock = context.RLock()
+
+    def Next(self):
+        with self._lock:
+            self._shared_nonce.value = max(int(time.time()), self._shared_nonce.value + 1)
+            return self._shared_nonce.value
+
+# Returns the first 'length' values of the shared array 'values' as an array.array.
+def _CopyArray(typecode, values, length):
+    copy = array.array(typecode)
+    copy.frombytes(ctypes.string_at(ctypes.addressof(values), length * copy.itemsize))
+    return copy
+
+# An OrderBookCache whose entries are shared by all processes through a Manager. Once there are
+# more than 'max_entries', the oldest fetched entries are evicted down to three quarters of that,
+# so that the entries are only copied over from the Manager every so often.
+class SharedOrderBookCache(exchange_api.OrderBookCache):
+    def __init__(self, context, manager, ttl=2, max_entries=256):
+        exchange_api.OrderBookCache.__init__(self, ttl, max_entries)
+        self._entries = manager.dict()
+        self._lock = context.Lock()
+
+    def Get(self, key, fetch):
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] < self._ttl:
+            return entry[1]
+
+        order_book = fetch()
+        self.Put(key, order_book, now)
+        return order_book
+
+    def Put(self, key, order_book, now=None):
+        with self._lock:
+            self._entries[key] = (time.time() if now is None else now, order_book)
+            if len(self._entries) > self._max_entries:
+                entries = sorted(self._entries.items(), key=lambda entry: entry[1][0])
+                for (old_key, _) in entries[:len(entries) - self._max_entries * 3 // 4]:
+                    self._entries.pop(old_key, None)
+
+    def Invalidate(self, key):
+        self._entries.pop(key, None)
+
+# The public market data of one exchange, shared between processes. The exchange instance that
+# publishes it is created with publish_market_data=True; those following it only with
+# market_data. 'context' is the multiprocessing context the processes are started from.
+# 'publisher_keys' are the values of the publishing exchange's config keys (see
+# Exchange.GetConfigKeys), in order; the follower using the same keys shares its nonces.
+class SharedMarketData(object):
+    def __init__(self, context, manager, capacity, publisher_keys=(), depth=6):
+        self._publisher_keys = tuple(publisher_keys)
+        self._publisher_nonce_counter = SharedNonceCounter(context)
+        self._price_store = SharedPriceStore(context, capacity, depth)
+        self._order_book_cache = SharedOrderBookCache(context, manager)
+        self._metadata = manager.dict()
+        self._generation = context.RawValue('l', 0)
+        self._failed = context.RawValue('b', 0)
+        self._ready = context.Event()
+
+    def GetPriceStore(self):
+        return self._price_store
+
+    def GetOrderBookCache(self):
+        return self._order_book_cache
+
+    # Returns the SharedNonceCounter of the publisher's API key if 'keys' are the publisher's
+    # config key values, so that the publisher and that account's follower never send the same
+    # nonce. Returns None for any other keys.
+    def GetNonceCounter(self, keys):
+        if tuple(keys) != self._publisher_keys:
+            return None
+        return self._publisher_nonce_counter
+
+    # Publishes the exchange's markets, as returned by its _GetSnapshotMetadata().
+    def Publish(self, metadata):
+        self._metadata['markets'] = metadata
+        self._generation.value += 1
+        self._ready.set()
+
+    # Tells waiting processes that no markets will be published.
+    def SetFailed(self):
+        self._failed.value = 1
+        self._ready.set()
+
+    # Returns a counter that changes whenever new markets are published.
+    def GetGeneration(self):
+        return self._generation.value
+
+    def GetMetadata(self):
+        return self._metadata.get('markets')
+
+    # Blocks until markets were published and returns True, or returns False if publishing
+    # failed or 'timeout' seconds passed.
+    def WaitForMarkets(self, timeout=None):
+        return self._ready.wait(timeout) and not self._failed.value
@@ -0,0 +1,132 @@
+import cryptsy_api
+import exchange_api
+import mock_exchanges
+import pytest
+import socket
+import time
+
+# Refreshes markets every 0.1s from the start, rather than after the default delay.
+class _Cryptsy(cryptsy_api.Cryptsy):
+    def _MarketRefreshLoop(self, revalidate):
+        self.SetMarketRefreshDelay(0.1)
+        cryptsy_api.Cryptsy._MarketRefreshLoop(self, revalidate)
+
+# Waits up to 'timeout' seconds for 'condition' to return True.
+def _WaitFor(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+def _CountRequests(mock, method):
+    return sum(1 for (_, served_method) in mock.request_log.GetRequests() if
+               served_method == method)
+
+@pytest.fixture
+def mock_cryptsy():
+    mock = mock_exchanges.MockCryptsy(market_count=3)
+    mock.Start()
+    yield mock
+    mock.Stop()
+
+@pytest.fixture
+def mock_stream():
+    mock = mock_exchanges.MockStream(market_count=3, interval=0.05)
+    mock.Start()
+    yield mock
+    mock.Stop()
+
+def testLoadsMarketsAndBalances(mock_cryptsy):
+    exchange = _Cryptsy('public', 'private', api_url=mock_cryptsy.GetApiUrl())
+    assert exchange.GetMarkets().HasMarket('ALT0', 'BTC')
+    assert exchange.GetMarkets().HasMarket('BTC', 'ALT0')
+    assert exchange.GetBalances()['ALT2'] == 0.00000005
+    assert exchange.GetMarkets()['ALT1']['BTC'].GetBestBid() == 0.00001
+
+_MARKET = '{"primary_currency_code": "ALT%d", "secondary_currency_code": "BTC"}'
+
+def _ScanMarkets(exchange, text):
+    exchange._RequestText = lambda method: text
+    return [market['primary_currency_code'] for market in exchange._IterMarkets()]
+
+def testScansMarketsAsTheyAreDecoded(mock_cryptsy):
+    exchange = cryptsy_api.Cryptsy('public', 'private', api_url=mock_cryptsy.GetApiUrl())
+    assert _ScanMarkets(exchange, ' { "success" : 1 , "return" : [ %s , %s ] } ' %
+                        (_MARKET % 0, _MARKET % 1)) == ['ALT0', 'ALT1']
+    assert _ScanMarkets(exchange, '{"return": []}') == []
+    with pytest.raises(exchange_api.ExchangeException):
+        _ScanMarkets(exchange, '{"success": 0, "error": "Invalid API key"}')
+
+@pytest.mark.parametrize('text', [
+    '{"return": [%s %s]}' % (_MARKET % 0, _MARKET % 1),
+    '{"success": 1 "return": [%s]}' % (_MARKET % 0),
+    '{"return": [%s,]}' % (_MARKET % 0),
+    '{"return": [%s]' % (_MARKET % 0),
+    '{1: 2, "return": []}'])
+def testRejectsMalformedMarkets(mock_cryptsy, text):
+    exchange = cryptsy_api.Cryptsy('public', 'private', api_url=mock_cryptsy.GetApiUrl())
+    with pytest.raises(ValueError):
+        _ScanMarkets(exchange, text)
+
+def testWarmStartsFromSnapshot(mock_cryptsy, tmpdir):
+    path = str(tmpdir.join('Cryptsy.snapshot'))
+    exchange = cryptsy_api.Cryptsy('public', 'private', api_url=mock_cryptsy.GetApiUrl(),
+                                   snapshot_path=path)
+    exchange._OnPriceUpdate('ALT0', 'BTC', 0.5, 0.75)
+    exchange._ApplyPushedPrices()
+    exchange._SaveSnapshot()
+
+    # The snapshot is enough to start with, even while the exchange is unreachable.
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+    server.close()
+    warm = cryptsy_api.Cryptsy('public', 'private', api_url='http://127.0.0.1:%d/api' % port,
+                               snapshot_path=path)
+    assert set(warm.GetMarkets().keys()) == set(exchange.GetMarkets().keys())
+    assert warm.GetMarkets()['ALT0']['BTC'].GetPriceTick() == (
+        exchange.GetMarkets()['ALT0']['BTC'].GetPriceTick())
+
+def testPushedDataReplacesPollingUntilStreamDrops(mock_cryptsy, mock_stream):
+    exchange = _Cryptsy('public', 'private', api_url=mock_cryptsy.GetApiUrl())
+    market = exchange.GetMarkets()['ALT0']['BTC']
+    exchange.Subscribe(exchange_api.JSONLinesStream(mock_stream.GetStreamUrl(), timeout=5),
+                       reconnect_delay=0.1)
+    assert _WaitFor(exchange.IsStreaming)
+    assert market in exchange.WaitForMarketUpdates(5)
+    assert _WaitFor(lambda: market.GetPrices()[0] == 0.00001)
+    assert market.GetDayMaxPrice() == 0.00002
+
+    # While the stream is up, markets aren't polled.
+    time.sleep(0.3)
+    refreshes = _CountRequests(mock_cryptsy, 'getmarkets')
+    time.sleep(0.3)
+    assert _CountRequests(mock_cryptsy, 'getmarkets') == refreshes
+
+    # Once it's down, polling takes over.
+    mock_stream.Stop()
+    assert _WaitFor(lambda: not exchange.IsStreaming())
+    assert _WaitFor(lambda: _CountRequests(mock_cryptsy, 'getmarkets') > refreshes + 1)
+
+def testPushedPricesAreRecordedOncePerRefresh(mock_cryptsy):
+    exchange = cryptsy_api.Cryptsy('public', 'private', api_url=mock_cryptsy.GetApiUrl())
+    market = exchange.GetMarkets()['ALT0']['BTC']
+    prices = market.GetPrices()
+    for price in range(1, 8):
+        exchange._OnPriceUpdate('ALT0', 'BTC', price, 8)
+    assert market.GetPrices() == prices
+    exchange._ApplyPushedPrices()
+    assert market.GetPriceTick() == ([7] + prices[:-1], 8)
+    assert exchange.WaitForMarketUpdates(0) == set([market, exchange.GetMarkets()['BTC']['ALT0']])
+
+def testStreamReconnects(mock_cryptsy, mock_stream):
+    exchange = _Cryptsy('public', 'private', api_url=mock_cryptsy.GetApiUrl())
+    exchange.Subscribe(exchange_api.JSONLinesStream(mock_stream.GetStreamUrl(), timeout=5),
+                       reconnect_delay=0.1)
+    assert _WaitFor(exchange.IsStreaming)
+    mock_stream.DropConnections()
+    assert _WaitFor(lambda: not exchange.IsStreaming())
+    assert _WaitFor(exchange.IsStreaming)
+    assert _CountRequests(mock_stream, 'stream') == 2
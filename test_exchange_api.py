@@ -0,0 +1,90 @@
+import exchange_api
+import mock_exchanges
+import pytest
+import socket
+
+class _Market(exchange_api.Market):
+    def __init__(self, source_currency, target_currency):
+        exchange_api.Market.__init__(self, None)
+        self._source_currency = source_currency
+        self._target_currency = target_currency
+
+    def GetSourceCurrency(self):
+        return self._source_currency
+
+    def GetTargetCurrency(self):
+        return self._target_currency
+
+def testOrderBookSortsAndWalksSides():
+    order_book = exchange_api.OrderBook([1, 3, 2], [10, 30, 20], [5, 4], [1, 2])
+    assert list(order_book.GetBids()[0]) == [3, 2, 1]
+    assert list(order_book.GetBids()[1]) == [30, 20, 10]
+    assert order_book.GetBestBid() == 3
+    assert order_book.GetBestAsk() == 4
+    assert order_book.GetDepth(True, 2) == 50
+    assert order_book.GetFill(True, 40) == (40, 30 * 3 + 10 * 2, 2)
+    assert order_book.GetFill(False, 0) == (0, 0, None)
+    assert exchange_api.OrderBook().GetBestBid() is None
+
+def testPriceStoreAddsTicksTogether():
+    store = exchange_api.PriceStore(depth=3)
+    (doge, ltc) = (store.AddSlot(), store.AddSlot())
+    store.AddTick(doge, 1, 2)
+    store.AddTicks([(doge, 3, 4), (ltc, 5, 6)])
+    assert store.GetTick(doge) == ([3, 1, -1], 4)
+    assert store.GetTick(ltc) == ([5, -1, -1], 6)
+    assert (store.GetVersion(doge), store.GetVersion(ltc)) == (2, 1)
+
+def testSnapshotRoundTrip(tmpdir):
+    path = str(tmpdir.join('Cryptsy.snapshot'))
+    store = exchange_api.PriceStore(depth=2)
+    store.AddTick(store.AddSlot(), 0.5, 0.75)
+    exchange_api.WriteSnapshot(path, {'markets' : [['DOGE', 'BTC', 1, 0, 1]]}, store)
+    (_, metadata, arrays) = exchange_api.ReadSnapshot(path)
+    assert metadata == {'markets' : [['DOGE', 'BTC', 1, 0, 1]]}
+
+    restored = exchange_api.PriceStore(depth=2)
+    restored.Restore(*arrays)
+    assert restored.GetTick(0) == ([0.5, -1], 0.75)
+
+    with open(path, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    with open(path, 'wb') as snapshot_file:
+        snapshot_file.write(data[:-1])
+    with pytest.raises(ValueError):
+        exchange_api.ReadSnapshot(path)
+
+def testMarketSnapshotAddLeavesOriginalUnchanged():
+    doge = _Market('DOGE', 'BTC')
+    snapshot = exchange_api.MarketSnapshot([doge], 1)
+    ltc = _Market('LTC', 'BTC')
+    newer = snapshot.Add([ltc])
+    assert newer.GetGeneration() == 2
+    assert set(newer.IterMarkets()) == set([doge, ltc])
+    assert list(snapshot.IterMarkets()) == [doge]
+    assert snapshot.HasMarket('DOGE', 'BTC') and not snapshot.HasMarket('LTC', 'BTC')
+    with pytest.raises(TypeError):
+        snapshot['DOGE']['LTC'] = ltc
+
+def testJSONLinesStreamEndsWhenDropped():
+    stream = mock_exchanges.MockStream(market_count=2, interval=0.05)
+    stream.Start()
+    try:
+        updates = []
+        for update in exchange_api.JSONLinesStream(stream.GetStreamUrl(), timeout=5).IterUpdates():
+            updates.append(update)
+            if len(updates) == 4:
+                stream.DropConnections()
+        assert [update['type'] for update in updates[:4]] == ['price', 'order_book'] * 2
+        assert updates[0]['source'] == 'ALT0' and updates[0]['last_trade'] == 0.00001
+    finally:
+        stream.Stop()
+
+def testJSONLinesStreamFailsWithoutServer():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+    server.close()
+    with pytest.raises(exchange_api.ExchangeException):
+        list(exchange_api.JSONLinesStream('http://127.0.0.1:%d/stream' % port,
+                                          timeout=5).IterUpdates())
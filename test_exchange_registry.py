@@ -0,0 +1,25 @@
+import exchange_registry
+import os
+import pytest
+import subprocess
+import sys
+
+def testListsExchangesInRegistrationOrder():
+    assert exchange_registry.GetNames() == ['CoinEx', 'Cryptsy']
+    assert exchange_registry.GetExchangeClass('Cryptsy').GetName() == 'Cryptsy'
+    with pytest.raises(KeyError):
+        exchange_registry.GetExchangeClass('Mintpal')
+
+def testImportsExchangesOnlyWhenUsed():
+    subprocess.check_call([sys.executable, '-c',
+                           'import exchange_registry, sys\n'
+                           'assert "cryptsy_api" not in sys.modules\n'
+                           'exchange_registry.GetExchangeClass("Cryptsy")\n'
+                           'assert "cryptsy_api" in sys.modules\n'
+                           'assert "coinex_api" not in sys.modules\n'],
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+
+def testRejectsMismatchedClass(monkeypatch):
+    monkeypatch.setitem(exchange_registry._exchanges, 'Bter', ('cryptsy_api', 'Cryptsy'))
+    with pytest.raises(ValueError):
+        exchange_registry.GetExchangeClass('Bter')
@@ -0,0 +1,43 @@
+import json
+import log_pipeline
+import threading
+
+# An output whose first write blocks until 'release' is set.
+class _BlockedOutput(object):
+    def __init__(self):
+        self.lines = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.writing.set()
+        self.release.wait(5)
+        self.lines.extend(text.splitlines())
+
+    def flush(self):
+        pass
+
+def testDropsMessagesWhileWriterIsBehind():
+    output = _BlockedOutput()
+    pipeline = log_pipeline.LogPipeline(output, json_lines=True, max_queued=2)
+    pipeline.Log('message %d', 0)
+    assert output.writing.wait(5)
+    for index in range(1, 6):
+        pipeline.Log('message %d', index)
+    output.release.set()
+    pipeline.Flush()
+    assert [json.loads(line)['message'] for line in output.lines] == [
+        'message 0', 'message 1', 'message 2', 'Dropped 3 log messages.']
+
+def testLogsSampledMessagesOncePerInterval():
+    output = _BlockedOutput()
+    output.release.set()
+    pipeline = log_pipeline.LogPipeline(output, json_lines=True, sample_interval=60)
+    for index in range(3):
+        pipeline.LogSampled('DOGE', 'DOGE %d', index)
+        pipeline.LogSampled('LTC', 'LTC %d', index)
+    pipeline.SetSampleInterval(0)
+    pipeline.LogSampled('DOGE', 'DOGE %d', 3)
+    pipeline.Flush()
+    assert [json.loads(line)['message'] for line in output.lines] == [
+        'DOGE 0', 'LTC 0', 'DOGE 3']
@@ -0,0 +1,40 @@
+import metrics
+import pytest
+import transport
+
+def testRendersCountersAndHistograms():
+    counter = metrics.Counter('test_failures_total', 'Test failures.', ('exchange', 'type'))
+    histogram = metrics.Histogram('test_seconds', 'Test durations.', ('exchange',),
+                                  buckets=(0.1, 1))
+    counter.Increment(('Cryptsy', 'timeout'))
+    counter.Increment(('Cryptsy', 'timeout'), 2)
+    counter.Increment(('Co"in\\Ex', 'error'))
+    histogram.Observe(0.05, ('Cryptsy',))
+    histogram.Observe(0.5, ('Cryptsy',))
+    histogram.Observe(5, ('Cryptsy',))
+
+    lines = metrics.Render().splitlines()
+    assert lines[lines.index('# HELP test_failures_total Test failures.'):][:4] == [
+        '# HELP test_failures_total Test failures.',
+        '# TYPE test_failures_total counter',
+        'test_failures_total{exchange="Co\\"in\\\\Ex",type="error"} 1',
+        'test_failures_total{exchange="Cryptsy",type="timeout"} 3']
+    assert lines[lines.index('# HELP test_seconds Test durations.'):][:7] == [
+        '# HELP test_seconds Test durations.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{exchange="Cryptsy",le="0.1"} 1',
+        'test_seconds_bucket{exchange="Cryptsy",le="1"} 2',
+        'test_seconds_bucket{exchange="Cryptsy",le="+Inf"} 3',
+        'test_seconds_sum{exchange="Cryptsy"} 5.55',
+        'test_seconds_count{exchange="Cryptsy"} 3']
+
+def testTimerCountsErrorTypes():
+    histogram = metrics.Histogram('test_timer_seconds', 'Timed blocks.', ('exchange',))
+    errors = metrics.Counter('test_timer_errors_total', 'Timed block errors.',
+                             ('exchange', 'type'))
+    with pytest.raises(transport.ExchangeException):
+        with metrics.Timer(histogram, ('Cryptsy',), errors):
+            raise transport.ExchangeException(KeyError('ALT0'))
+    assert histogram.GetTotals(('Cryptsy',))[0] == 1
+    assert 'test_timer_errors_total{exchange="Cryptsy",type="KeyError"} 1' in (
+        metrics.Render().splitlines())
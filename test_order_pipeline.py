@@ -0,0 +1,60 @@
+import exchange_api
+import order_pipeline
+import socket
+
+class _Exchange(object):
+    def GetName(self):
+        return 'Test'
+
+class _Market(object):
+    def __init__(self, best_bid, error=None):
+        self._best_bid = best_bid
+        self._error = error
+
+    def GetExchange(self):
+        return _Exchange()
+
+    def GetSourceCurrency(self):
+        return 'DOGE'
+
+    def GetBestBid(self):
+        if self._error is not None:
+            raise self._error
+        return self._best_bid
+
+    def CreateOrder(self, bid_order, amount, price):
+        return exchange_api.Order(self, 1, bid_order, amount, price)
+
+def _Sell(pipeline, markets):
+    assert pipeline.Submit(markets, 5)
+    pipeline.Join()
+
+def testSellsIntoFirstMarketWithBids():
+    results = []
+    pipeline = order_pipeline.OrderPipeline(2, results.append)
+    markets = [_Market(None), _Market(0.5), _Market(0.7)]
+    _Sell(pipeline, markets)
+    assert [result.stage for result in results] == ['no_bids', None]
+    assert results[1].market is markets[1]
+    assert results[1].order.GetPrice() == 0.5
+
+def testReportsExchangeErrors():
+    results = []
+    pipeline = order_pipeline.OrderPipeline(1, results.append)
+    error = exchange_api.ExchangeException(socket.error('connection refused'))
+    _Sell(pipeline, [_Market(0.5, error)])
+    assert [(result.stage, result.error) for result in results] == [('order_book', error)]
+
+def testWorkersSurviveUnexpectedErrors():
+    results = []
+    def Report(result):
+        results.append(result)
+        if result.order is not None:
+            raise ValueError('report failed')
+    pipeline = order_pipeline.OrderPipeline(1, Report)
+    _Sell(pipeline, [_Market(0.5, KeyError('bug'))])
+    _Sell(pipeline, [_Market(0.5)])
+    _Sell(pipeline, [_Market(0.5)])
+    assert results[0].stage == 'error'
+    assert isinstance(results[0].error, KeyError)
+    assert [result.order is not None for result in results[1:]] == [True, True]
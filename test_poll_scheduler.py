@@ -0,0 +1,41 @@
+import poll_scheduler
+
+class _Market(object):
+    def __init__(self):
+        self.price_version = 0
+
+    def GetPriceVersion(self):
+        return self.price_version
+
+def testSchedulerPollsNearTriggerMarketsFaster():
+    scheduler = poll_scheduler.PollScheduler(60, 10)
+    (near, far) = (_Market(), _Market())
+    assert scheduler.IsDue(near, 0) and scheduler.IsDue(far, 0)
+    assert scheduler.GetNextDue(0) == 60
+    scheduler.Reschedule(near, 0, True)
+    scheduler.Reschedule(far, 0, False)
+    assert not scheduler.IsDue(near, 5) and scheduler.IsDue(near, 10)
+    assert not scheduler.IsDue(far, 59) and scheduler.IsDue(far, 60)
+    assert scheduler.GetNextDue(0) == 10
+
+    scheduler.MarkDue(far)
+    assert scheduler.IsDue(far, 1)
+    scheduler.Prune(set([far]))
+    assert scheduler.IsDue(near, 1)
+    assert scheduler.GetNextDue(1) == 61
+
+def testTrackerSkipsUnchangedMarkets():
+    tracker = poll_scheduler.ChangeTracker()
+    market = _Market()
+    state = tracker.GetState(market, 5)
+    assert tracker.HasChanged(market, state)
+    tracker.MarkClean(market, state, True)
+    assert not tracker.HasChanged(market, tracker.GetState(market, 5))
+    assert tracker.WasNearTrigger(market)
+
+    assert tracker.HasChanged(market, tracker.GetState(market, 6))
+    market.price_version += 1
+    assert tracker.HasChanged(market, tracker.GetState(market, 5))
+
+    tracker.Prune(set())
+    assert tracker.HasChanged(market, state)
@@ -0,0 +1,52 @@
+import exchange_api
+import sell_routes
+
+class _Market(exchange_api.Market):
+    def __init__(self, source_currency, target_currency):
+        exchange_api.Market.__init__(self, None)
+        self._source_currency = source_currency
+        self._target_currency = target_currency
+
+    def GetSourceCurrency(self):
+        return self._source_currency
+
+    def GetTargetCurrency(self):
+        return self._target_currency
+
+class _Exchange(object):
+    def __init__(self, markets):
+        self.snapshot = exchange_api.MarketSnapshot(markets, 1)
+
+    def GetMarkets(self):
+        return self.snapshot
+
+    def GetMarketsGeneration(self):
+        return self.snapshot.GetGeneration()
+
+def testRoutesFollowTargetPriority():
+    markets = [_Market('DOGE', 'LTC'), _Market('DOGE', 'BTC'), _Market('LTC', 'BTC'),
+               _Market('BTC', 'LTC'), _Market('DOGE', 'XYZ')]
+    routes = sell_routes.RouteIndex(['BTC', 'LTC'], [])
+    routes.Sync(_Exchange(markets))
+    assert routes.GetRoutes('DOGE') == [markets[1], markets[0]]
+    assert routes.GetRoutes('LTC') == [markets[2]]
+    assert routes.GetRoutes('BTC') == []
+    assert routes.GetRoutes('FTC') == ()
+
+def testSyncOnlyRebuildsChangedRoutes():
+    doge = _Market('DOGE', 'BTC')
+    exchange = _Exchange([doge])
+    routes = sell_routes.RouteIndex(['BTC'], ['DOGE', 'LTC'])
+    routes.Sync(exchange)
+    doge_routes = routes.GetRoutes('DOGE')
+
+    ltc = _Market('LTC', 'BTC')
+    exchange.snapshot = exchange.snapshot.Add([ltc, _Market('FTC', 'BTC')])
+    routes.Sync(exchange)
+    assert routes.GetRoutes('DOGE') is doge_routes
+    assert routes.GetRoutes('LTC') == [ltc]
+    assert routes.GetRoutes('FTC') == ()
+
+    exchange.snapshot = exchange_api.MarketSnapshot([ltc], 3)
+    routes.Sync(exchange)
+    assert routes.GetRoutes('DOGE') == ()
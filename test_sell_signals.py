@@ -0,0 +1,51 @@
+import exchange_api
+import pytest
+import random
+import sell_signals
+
+class _Exchange(object):
+    def __init__(self, price_store):
+        self._price_store = price_store
+
+    def GetPriceStore(self):
+        return self._price_store
+
+class _Market(object):
+    def __init__(self, exchange, slot):
+        self._exchange = exchange
+        self._slot = slot
+
+    def GetExchange(self):
+        return self._exchange
+
+    def GetPriceSlot(self):
+        return self._slot
+
+    def GetTradeMinimum(self):
+        return 0.5
+
+    def GetPriceTick(self):
+        return self._exchange.GetPriceStore().GetTick(self._slot)
+
+# Returns (market, balance) candidates over random price histories, with few distinct prices so
+# that flat and falling prices are common.
+def _RandomCandidates(count, depth=6):
+    rng = random.Random(1)
+    price_store = exchange_api.PriceStore(depth=depth)
+    exchange = _Exchange(price_store)
+    candidates = []
+    for _ in range(count):
+        slot = price_store.AddSlot()
+        for _ in range(rng.randint(0, depth + 2)):
+            price_store.AddTick(slot, rng.choice([0, 1, 2, 3]), rng.choice([1, 2, 3, 4]))
+        candidates.append((_Market(exchange, slot), rng.choice([0, 0, 1])))
+    return candidates
+
+@pytest.mark.parametrize('flat_ticks', [2, sell_signals.FLAT_TICKS])
+def testNumPyMatchesScalarEvaluation(monkeypatch, flat_ticks):
+    pytest.importorskip('numpy')
+    candidates = _RandomCandidates(500)
+    vectorized = sell_signals.Evaluate(candidates, 0.05, flat_ticks=flat_ticks)
+    monkeypatch.setattr(sell_signals, 'numpy', None)
+    assert sell_signals.Evaluate(candidates, 0.05, flat_ticks=flat_ticks) == vectorized
+    assert any(vectorized[0]) and not all(vectorized[0]) and any(vectorized[1])
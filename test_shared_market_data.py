@@ -0,0 +1,46 @@
+import multiprocessing
+import pytest
+import shared_market_data
+import sys
+import time
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='needs fork')
+
+def _TakeNonces(nonce_counter, nonces):
+    for _ in range(50):
+        nonces.put(nonce_counter.Next())
+
+def testPublisherNoncesAreSharedAcrossProcesses():
+    context = multiprocessing.get_context('fork')
+    manager = shared_market_data.StartManager(context)
+    try:
+        market_data = shared_market_data.SharedMarketData(context, manager, 16,
+                                                          ['private', 'public'])
+        assert market_data.GetNonceCounter(('private', 'other')) is None
+        nonce_counter = market_data.GetNonceCounter(('private', 'public'))
+
+        nonces = context.Queue()
+        processes = [context.Process(target=_TakeNonces, args=(nonce_counter, nonces)) for
+                     _ in range(3)]
+        for process in processes:
+            process.start()
+        taken = [nonces.get(timeout=10) for _ in range(150)]
+        for process in processes:
+            process.join()
+        assert len(set(taken)) == 150
+        assert nonce_counter.Next() > max(taken)
+    finally:
+        manager.shutdown()
+
+def testOrderBookCacheEvictsOldestEntries():
+    context = multiprocessing.get_context('fork')
+    manager = shared_market_data.StartManager(context)
+    try:
+        cache = shared_market_data.SharedOrderBookCache(context, manager, max_entries=8)
+        now = time.time()
+        for key in range(9):
+            cache.Put(key, 'book%d' % key, now=now + key)
+        assert sorted(cache._entries.keys()) == [3, 4, 5, 6, 7, 8]
+        assert cache.Get(8, lambda: None) == 'book8'
+    finally:
+        manager.shutdown()
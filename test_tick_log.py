@@ -0,0 +1,52 @@
+import pytest
+import tick_log
+
+def _Record(path, timestamp, last_trade):
+    recorder = tick_log.TickRecorder(path)
+    recorder.RecordPrices(timestamp, [('DOGE', 'BTC', last_trade, 2 * last_trade)])
+    recorder.RecordOrderBook(timestamp, 'DOGE', 'BTC', last_trade, 100)
+    recorder.Close()
+
+def testRoundTrip(tmpdir):
+    path = str(tmpdir.join('Cryptsy.ticks'))
+    _Record(path, 1, 0.5)
+    _Record(path, 2, 0.25)
+
+    reader = tick_log.TickLogReader(path)
+    assert list(reader.IterMarkets()) == [(0, 'DOGE', 'BTC')]
+    assert list(reader.IterTicks()) == [('price', 0, 1, 0.5, 1.0),
+                                        ('order_book', 0, 1, 0.5, 100),
+                                        ('price', 0, 2, 0.25, 0.5),
+                                        ('order_book', 0, 2, 0.25, 100)]
+
+def testTornRecordIsDroppedBeforeAppending(tmpdir):
+    path = str(tmpdir.join('Cryptsy.ticks'))
+    _Record(path, 1, 0.5)
+    with open(path, 'ab') as log_file:
+        log_file.write(b'\x01\x00\x00')  # a crash in the middle of a write
+    _Record(path, 2, 0.25)
+
+    ticks = list(tick_log.TickLogReader(path).IterTicks())
+    assert ticks == [('price', 0, 1, 0.5, 1.0),
+                     ('order_book', 0, 1, 0.5, 100),
+                     ('price', 0, 2, 0.25, 0.5),
+                     ('order_book', 0, 2, 0.25, 100)]
+
+def testTornHeaderIsRewritten(tmpdir):
+    path = str(tmpdir.join('Cryptsy.ticks'))
+    with open(path, 'wb') as log_file:
+        log_file.write(b'AATI')
+    _Record(path, 1, 0.5)
+
+    reader = tick_log.TickLogReader(path)
+    assert list(reader.IterMarkets()) == [(0, 'DOGE', 'BTC')]
+    assert len(list(reader.IterTicks())) == 2
+
+def testForeignFileIsLeftAlone(tmpdir):
+    path = str(tmpdir.join('Cryptsy.ticks'))
+    with open(path, 'wb') as log_file:
+        log_file.write(b'price,timestamp\n')
+    with pytest.raises(IOError):
+        tick_log.TickRecorder(path)
+    with open(path, 'rb') as log_file:
+        assert log_file.read() == b'price,timestamp\n'
@@ -0,0 +1,240 @@
+import pytest
+import socket
+import threading
+import time
+import transport
+
+def _Fail(timeout):
+    raise transport.ExchangeException(socket.error('connection refused'))
+
+def testCircuitOpensAfterFailureThreshold():
+    breaker = transport.CircuitBreaker(failure_threshold=3, base_delay=60)
+    for _ in range(2):
+        assert breaker.Check('Test') is False
+        assert breaker.RecordFailure(False) is False
+    assert not breaker.IsOpen()
+    assert breaker.RecordFailure(False) is True
+    assert breaker.IsOpen()
+    with pytest.raises(transport.ExchangeException) as error:
+        breaker.Check('Test')
+    assert error.value.exception_type == 'CircuitOpenError'
+
+def testCircuitLetsOneProbeThroughAndBacksOff():
+    breaker = transport.CircuitBreaker(failure_threshold=1, base_delay=0.05, max_delay=0.15)
+    breaker.RecordFailure(False)
+    time.sleep(0.06)
+    assert breaker.Check('Test') is True
+    with pytest.raises(transport.ExchangeException):
+        breaker.Check('Test')  # only one probe at a time
+
+    # A failed probe keeps the circuit open for twice as long.
+    assert breaker.RecordFailure(True) is True
+    time.sleep(0.06)
+    with pytest.raises(transport.ExchangeException):
+        breaker.Check('Test')
+    time.sleep(0.05)
+    assert breaker.Check('Test') is True
+
+    # ... up to 'max_delay'.
+    breaker.RecordFailure(True)
+    time.sleep(0.16)
+    assert breaker.Check('Test') is True
+
+    breaker.RecordSuccess()
+    assert not breaker.IsOpen()
+    assert breaker.Check('Test') is False
+
+def testCancelledProbeLetsAnotherThrough():
+    breaker = transport.CircuitBreaker(failure_threshold=1, base_delay=0)
+    breaker.RecordFailure(False)
+    assert breaker.Check('Test') is True
+    breaker.CancelProbe()
+    assert breaker.Check('Test') is True
+
+def testHedgeAnswersWhenFirstCallHangs():
+    calls = []
+    hedges = []
+    def Request(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            time.sleep(1)
+            return 'slow'
+        return 'fast'
+    start = time.time()
+    assert transport.HedgedCall(Request, 0.05, 5, lambda: hedges.append(1)) == 'fast'
+    assert time.time() - start < 0.5
+    assert hedges == [1]
+
+def testHedgedCallRaisesOnceEveryCallFailed():
+    start = time.time()
+    with pytest.raises(transport.ExchangeException) as error:
+        transport.HedgedCall(_Fail, 0.05, 5)
+    assert error.value.exception_type == type(socket.error()).__name__
+    assert time.time() - start < 0.5
+
+def testHedgedCallTimesOut():
+    with pytest.raises(transport.ExchangeException) as error:
+        transport.HedgedCall(lambda timeout: time.sleep(1), 0.05, 0.1)
+    assert error.value.exception_type == type(socket.timeout()).__name__
+
+def testHedgedCallRaisesOtherErrorsRightAway():
+    def Request(timeout):
+        raise KeyError('bug')
+    start = time.time()
+    with pytest.raises(KeyError):
+        transport.HedgedCall(Request, 1, 3)
+    assert time.time() - start < 0.5
+
+def testPriorityRequestsGoFirst():
+    bucket = transport.TokenBucket(20, 1)
+    bucket.Acquire()
+    served = []
+    lock = threading.Lock()
+    def Acquire(name, priority):
+        bucket.Acquire(priority)
+        with lock:
+            served.append(name)
+    threads = [threading.Thread(target=Acquire, args=('normal%d' % index, False)) for
+               index in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.01)
+    threads.append(threading.Thread(target=Acquire, args=('priority', True)))
+    threads[-1].start()
+    for thread in threads:
+        thread.join()
+    assert served[0] == 'priority'
+
+def testPriorityRequestsLeaveOthersAShare():
+    bucket = transport.TokenBucket(20, 1)
+    served = []
+    lock = threading.Lock()
+    done = threading.Event()
+    def Acquire(name, priority):
+        while not done.is_set():
+            bucket.Acquire(priority)
+            with lock:
+                served.append(name)
+    threads = [threading.Thread(target=Acquire, args=(name, name == 'priority')) for
+               name in ('priority', 'priority', 'normal')]
+    for thread in threads:
+        thread.start()
+    time.sleep(1)
+    done.set()
+    for thread in threads:
+        thread.join()
+    assert served.count('normal') >= 3
+
+def testSetRateCapsBurst():
+    bucket = transport.TokenBucket(1000, 10)
+    bucket.SetRate(10, 1)
+    start = time.time()
+    for _ in range(3):
+        bucket.Acquire()
+    assert time.time() - start >= 0.15
+
+def testZeroRateDisablesLimit():
+    bucket = transport.TokenBucket(1, 1)
+    bucket.SetRate(0)
+    start = time.time()
+    for _ in range(100):
+        bucket.Acquire()
+    assert time.time() - start < 0.1
+
+# Serves 'responses' requests on each connection, then closes it when the next request arrives
+# without answering it, as a server dropping a keep-alive connection would. Returns the port and
+# the list of request methods received.
+def _StartDroppingServer(responses=1):
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(5)
+    methods = []
+    def Serve(connection):
+        for index in range(responses + 1):
+            request = connection.recv(65536)
+            if not request:
+                break
+            methods.append(request.split(b' ')[0].decode('ascii'))
+            if index == responses:
+                break
+            connection.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        connection.close()
+    def Accept():
+        while True:
+            (connection, _) = server.accept()
+            thread = threading.Thread(target=Serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+    thread = threading.Thread(target=Accept)
+    thread.daemon = True
+    thread.start()
+    return (server.getsockname()[1], methods)
+
+def testPoolResendsGetOnDroppedConnection():
+    (port, methods) = _StartDroppingServer()
+    pool = transport.ConnectionPool()
+    url = 'http://127.0.0.1:%d/markets' % port
+    assert pool.Request(url) == b'ok'
+    assert pool.Request(url) == b'ok'
+    assert methods == ['GET', 'GET', 'GET']
+
+def testPoolDoesNotResendDeliveredPost():
+    (port, methods) = _StartDroppingServer()
+    pool = transport.ConnectionPool()
+    url = 'http://127.0.0.1:%d/orders' % port
+    assert pool.Request(url) == b'ok'
+    with pytest.raises(transport.ExchangeException):
+        pool.Request(url, b'order=1')
+    assert methods == ['GET', 'POST']
+
+def testPoolResendsIdempotentPost():
+    (port, methods) = _StartDroppingServer()
+    pool = transport.ConnectionPool()
+    url = 'http://127.0.0.1:%d/api' % port
+    assert pool.Request(url) == b'ok'
+    assert pool.Request(url, b'method=getinfo', idempotent=True) == b'ok'
+    assert methods[:2] == ['GET', 'POST'] and methods.count('POST') == 2
+
+def testSignedRequestWaitsForNonceLock():
+    (port, _) = _StartDroppingServer()
+    nonce_counter = transport.NonceCounter()
+    nonces = []
+    def Sign():
+        nonces.append(nonce_counter.Next())
+        return (b'nonce=%d' % nonces[-1], {})
+    results = []
+    def Request():
+        results.append(transport.ConnectionPool().Request(
+            'http://127.0.0.1:%d/api' % port, sign=Sign, write_lock=nonce_counter.GetLock()))
+    with nonce_counter.GetLock():
+        nonce = nonce_counter.Next()
+        thread = threading.Thread(target=Request)
+        thread.start()
+        time.sleep(0.1)
+        assert nonces == []
+    thread.join()
+    assert results == [b'ok'] and nonces[0] > nonce
+
+def testPoolEnforcesDeadlineOnTricklingResponse():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    def Serve():
+        (connection, _) = server.accept()
+        connection.recv(65536)
+        connection.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n')
+        try:
+            for _ in range(100):
+                connection.sendall(b'x')
+                time.sleep(0.05)
+        except socket.error:
+            pass
+        connection.close()
+    thread = threading.Thread(target=Serve)
+    thread.daemon = True
+    thread.start()
+    start = time.time()
+    with pytest.raises(transport.ExchangeException):
+        transport.ConnectionPool().Request('http://127.0.0.1:%d/' % server.getsockname()[1],
+                                              timeout=0.3)
+    assert time.time() - start < 1
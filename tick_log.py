@@ -0,0 +1,126 @@
+# An append-only binary log of market data ticks, for replaying the sell strategy offline.
+#
+# The log is a 32-byte header followed by fixed-size 32-byte records, so it can be memory-mapped
+# and decoded with struct.iter_unpack. Each record starts with its kind and a market key:
+#   _MARKET:      defines the market key: source and target currency codes (12 bytes each).
+#   _PRICE:       timestamp, last trade price and day's max price of a market.
+#   _ORDER_BOOK:  timestamp, best bid price and amount of a market's order book.
+
+import mmap
+import struct
+import threading
+
+_HEADER = b'AATICKS1'.ljust(32, b'\0')
+_RECORD = struct.Struct('<B3xIddd')
+_MARKET_RECORD = struct.Struct('<B3xI12s12s')
+
+_MARKET = 0
+_PRICE = 1
+_ORDER_BOOK = 2
+
+# Appends ticks to the log at 'path', creating it if necessary. Raises IOError if 'path' is some
+# other file.
+class TickRecorder(object):
+    def __init__(self, path):
+        self._market_keys = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'rb') as log_file:
+                header = log_file.read(len(_HEADER))
+        except FileNotFoundError:
+            header = b''
+        if not _HEADER.startswith(header):
+            raise IOError('Not a tick log: %s' % path)
+        if header == _HEADER:
+            reader = TickLogReader(path)
+            try:
+                for (key, source_currency, target_currency) in reader.IterMarkets():
+                    self._market_keys[(source_currency, target_currency)] = key
+            finally:
+                reader.Close()
+        self._file = open(path, 'ab')
+        size = self._file.tell()
+        if size < len(_HEADER):
+            # A new log, or one whose header write was torn.
+            self._file.truncate(0)
+            self._file.write(_HEADER)
+            self._file.flush()
+        elif (size - len(_HEADER)) % _RECORD.size:
+            # Drop a record torn by a crash, so that new records start on a record boundary.
+            self._file.truncate(size - (size - len(_HEADER)) % _RECORD.size)
+
+    def _GetMarketKey(self, source_currency, target_currency, records):
+        key = self._market_keys.get((source_currency, target_currency))
+        if key is None:
+            key = self._market_keys[(source_currency, target_currency)] = len(self._market_keys)
+            records.append(_MARKET_RECORD.pack(_MARKET, key, source_currency.encode('utf-8'),
+                                               target_currency.encode('utf-8')))
+        return key
+
+    def _Write(self, records):
+        self._file.write(b''.join(records))
+        self._file.flush()
+
+    # Records one market data refresh: 'prices' is a list of (source currency, target currency,
+    # last trade price, day's max price) tuples, all taken at 'timestamp'.
+    def RecordPrices(self, timestamp, prices):
+        with self._lock:
+            records = []
+            for (source_currency, target_currency, last_trade, day_max_price) in prices:
+                key = self._GetMarketKey(source_currency, target_currency, records)
+                records.append(_RECORD.pack(_PRICE, key, timestamp, last_trade, day_max_price))
+            self._Write(records)
+
+    # Records the best bid of a market's order book at 'timestamp'.
+    def RecordOrderBook(self, timestamp, source_currency, target_currency, best_bid, amount):
+        with self._lock:
+            records = []
+            key = self._GetMarketKey(source_currency, target_currency, records)
+            records.append(_RECORD.pack(_ORDER_BOOK, key, timestamp, best_bid, amount))
+            self._Write(records)
+
+    def Close(self):
+        with self._lock:
+            self._file.close()
+
+# Reads a tick log by memory-mapping it.
+class TickLogReader(object):
+    def __init__(self, path):
+        with open(path, 'rb') as log_file:
+            if log_file.read(len(_HEADER)) != _HEADER:
+                raise IOError('Not a tick log: %s' % path)
+            log_file.seek(0, 2)
+            size = log_file.tell()
+            # Ignore a partially written last record.
+            self._end = size - (size - len(_HEADER)) % _RECORD.size
+            self._data = (mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) if
+                          self._end > len(_HEADER) else b'')
+
+    def Close(self):
+        if self._data:
+            self._data.close()
+        self._data = b''
+
+    def _IterRecords(self):
+        if not self._data:
+            return iter(())
+        return _RECORD.iter_unpack(memoryview(self._data)[len(_HEADER):self._end])
+
+    # Yields a (key, source currency, target currency) tuple for every market in the log.
+    def IterMarkets(self):
+        offset = len(_HEADER)
+        for record in self._IterRecords():
+            if record[0] == _MARKET:
+                (_, key, source_currency, target_currency) = _MARKET_RECORD.unpack_from(
+                    self._data, offset)
+                yield (key, source_currency.rstrip(b'\0').decode('utf-8'),
+                       target_currency.rstrip(b'\0').decode('utf-8'))
+            offset += _RECORD.size
+
+    # Yields every tick as a (kind, market key, timestamp, value1, value2) tuple, where 'kind' is
+    # 'price' or 'order_book'. Market definitions are skipped; see IterMarkets.
+    def IterTicks(self):
+        kinds = {_PRICE : 'price', _ORDER_BOOK : 'order_book'}
+        for (kind, key, timestamp, value1, value2) in self._IterRecords():
+            if kind != _MARKET:
+                yield (kinds[kind], key, timestamp, value1, value2)
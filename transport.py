@@ -0,0 +1,359 @@
+# How requests reach the exchanges' APIs: a shared pool of keep-alive connections, and the rate
+# limiting, nonce ordering, circuit breaking and hedging that every request to an exchange goes
+# through.
+
+import collections
+import errno
+import http.client
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.parse
+
+# An exception that any methods in exchange may raise.
+class ExchangeException(Exception):
+
+    def __init__(self, exception):
+        message = '[%s] %s' % (type(exception).__name__, exception)
+        Exception.__init__(self, message)
+        self.exception_type = type(exception).__name__
+
+# Returns whether 'error', raised by a request on a reused keep-alive connection, means that the
+# server had closed the connection.
+def _IsStaleConnectionError(error):
+    if isinstance(error, http.client.BadStatusLine):
+        return True
+    return (isinstance(error, socket.error) and
+            getattr(error, 'errno', None) in (errno.ECONNRESET, errno.EPIPE))
+
+# Makes the socket operations of 'connection' time out at 'end', a time.time(), or raises
+# socket.timeout if it has passed.
+def _SetRemainingTimeout(connection, end):
+    remaining = end - time.time()
+    if remaining <= 0:
+        raise socket.timeout('timed out')
+    connection.timeout = remaining
+    if connection.sock is not None:
+        connection.sock.settimeout(remaining)
+
+# Reads the body of 'response' a piece at a time, so that a response trickling in can't run past
+# 'end' by resetting the socket timeout with every few bytes.
+def _ReadBody(connection, response, end):
+    chunks = []
+    while True:
+        _SetRemainingTimeout(connection, end)
+        chunk = response.read1(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    # read1() doesn't mark a fully read response as closed, which the connection needs before it
+    # can send another request.
+    response.read()
+    return b''.join(chunks)
+
+# A thread-safe pool of keep-alive HTTP(S) connections, keyed by (scheme, host, port).
+# Connections that sat idle for longer than 'idle_timeout' seconds are assumed to have been
+# closed by the server and are discarded; servers commonly close them after 5 to 15 seconds. A
+# reused connection that the server dropped anyway is replaced with a fresh one and the request
+# retried, unless it was a POST that the server may already have received and that isn't
+# idempotent.
+class ConnectionPool(object):
+    def __init__(self, timeout=30, idle_timeout=5, max_idle=4):
+        self._timeout = timeout
+        self._idle_timeout = idle_timeout
+        self._max_idle = max_idle
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _Acquire(self, key):
+        now = time.time()
+        with self._lock:
+            idle = self._idle[key]
+            while idle:
+                connection, last_used = idle.pop()
+                if now - last_used < self._idle_timeout:
+                    return connection, True
+                connection.close()
+        (scheme, host, port) = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(host, port, timeout=self._timeout), False
+        return http.client.HTTPConnection(host, port, timeout=self._timeout), False
+
+    def _Release(self, key, connection):
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self._max_idle:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    # Sends a GET request, or a POST if 'post_data' or 'sign' is given, and returns the response
+    # body. Set 'idempotent' for a POST that only reads, so that it can be resent like a GET.
+    # 'sign', if given, is called just before the request is written and returns its
+    # (post_data, headers), so that every attempt carries a fresh nonce. It's called, and the
+    # request written, while holding 'write_lock', so that requests signed with one key are
+    # written in nonce order. 'timeout' (or the pool's) is the deadline for the whole request, in
+    # seconds, not just for each socket operation. Raises an ExchangeException on connection
+    # errors, timeouts and non-200 responses.
+    def Request(self, url, post_data=None, headers=None, timeout=None, sign=None,
+                write_lock=None, idempotent=False):
+        url_parts = urllib.parse.urlsplit(url)
+        key = (url_parts.scheme, url_parts.hostname, url_parts.port)
+        path = url_parts.path or '/'
+        if url_parts.query:
+            path += '?' + url_parts.query
+        method = 'GET' if post_data is None and sign is None else 'POST'
+        idempotent = idempotent or method == 'GET'
+        end = time.time() + (self._timeout if timeout is None else timeout)
+
+        while True:
+            (connection, reused) = self._Acquire(key)
+            sent = False
+            try:
+                _SetRemainingTimeout(connection, end)
+                if write_lock is None:
+                    if sign is not None:
+                        (post_data, headers) = sign()
+                    connection.request(method, path, post_data, headers or {})
+                else:
+                    # Connect first, so a slow handshake doesn't hold up other signed requests.
+                    if connection.sock is None:
+                        connection.connect()
+                    if not write_lock.acquire(True, max(0, end - time.time())):
+                        raise socket.timeout('timed out')
+                    try:
+                        if sign is not None:
+                            (post_data, headers) = sign()
+                        _SetRemainingTimeout(connection, end)
+                        connection.request(method, path, post_data, headers or {})
+                    finally:
+                        write_lock.release()
+                sent = True
+                _SetRemainingTimeout(connection, end)
+                response = connection.getresponse()
+                body = _ReadBody(connection, response, end)
+            except (http.client.HTTPException, socket.error) as e:
+                connection.close()
+                # The server may have closed a reused connection while it was idle. Only resend
+                # if that can't repeat a request the server already acted on, e.g. an order.
+                if reused and _IsStaleConnectionError(e) and (idempotent or not sent):
+                    continue
+                raise ExchangeException(e)
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._Release(key, connection)
+            if response.status != 200:
+                raise ExchangeException(http.client.HTTPException(
+                    'HTTP %d %s' % (response.status, response.reason)))
+            return body
+
+_connection_pool = ConnectionPool()
+
+def _ResetConnectionPool():
+    global _connection_pool
+    _connection_pool = ConnectionPool()
+
+if hasattr(os, 'register_at_fork'):
+    # A forked process must not reuse its parent's keep-alive connections.
+    os.register_at_fork(after_in_child=_ResetConnectionPool)
+
+# Sends a request through the shared ConnectionPool. See ConnectionPool.Request.
+def HTTPRequest(url, post_data=None, headers=None, timeout=None, sign=None, write_lock=None,
+                idempotent=False):
+    return _connection_pool.Request(url, post_data, headers, timeout, sign, write_lock,
+                                    idempotent)
+
+# A token bucket limiting requests to 'rate' per second on average, in bursts of up to 'burst'.
+# Priority requests, e.g. market data refreshes, are served ahead of the others, but only up to
+# 'priority_share' of the rate; beyond that they wait their turn, so the others aren't starved.
+# A rate of 0 disables the limit.
+class TokenBucket(object):
+    def __init__(self, rate, burst=1, priority_share=0.5):
+        self._rate = float(rate)
+        self._burst = float(burst)
+        self._tokens = float(burst)
+        self._priority_share = priority_share
+        self._priority_tokens = float(burst)
+        self._last_refill = time.time()
+        self._waiting = collections.deque()
+        self._lock = threading.Lock()
+        self._refilled = threading.Condition(self._lock)
+
+    def GetRate(self):
+        return self._rate
+
+    # Sets the rate and, if given, the burst size.
+    def SetRate(self, rate, burst=None):
+        with self._lock:
+            self._rate = float(rate)
+            if burst is not None:
+                self._burst = float(burst)
+                self._tokens = min(self._tokens, self._burst)
+                self._priority_tokens = min(self._priority_tokens, self._burst)
+
+    def _Refill(self):
+        now = time.time()
+        elapsed = now - self._last_refill
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+        self._priority_tokens = min(self._burst, self._priority_tokens +
+                                    elapsed * self._rate * self._priority_share)
+        self._last_refill = now
+
+    # Takes a token, first sleeping until one is available if necessary. Priority callers that
+    # have to wait reserve their token up front, so they are served in order. Other callers take
+    # a token once one is available, one at a time in the order they came, so a priority caller
+    # only ever waits for tokens taken by other priority callers. Priority callers beyond the
+    # priority share queue up with the others.
+    def Acquire(self, priority=False):
+        if not self._rate:
+            return
+        with self._lock:
+            self._Refill()
+            if priority and self._priority_tokens >= 1:
+                self._priority_tokens -= 1
+            else:
+                turn = object()
+                self._waiting.append(turn)
+                while self._waiting[0] is not turn or self._tokens < 1:
+                    if self._waiting[0] is turn:
+                        self._refilled.wait((1 - self._tokens) / self._rate)
+                    else:
+                        self._refilled.wait()
+                    self._Refill()
+                self._waiting.popleft()
+                self._refilled.notify_all()
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+# Hands out the nonces of signed requests made with one API key. Nonces strictly increase, even
+# when several requests go out in one second. The exchange rejects a nonce lower than one it has
+# already seen, so callers hold GetLock() from taking a nonce until their request is written.
+class NonceCounter(object):
+    def __init__(self):
+        self._nonce = 0
+        self._lock = threading.RLock()
+
+    def GetLock(self):
+        return self._lock
+
+    def Next(self):
+        with self._lock:
+            self._nonce = max(int(time.time()), self._nonce + 1)
+            return self._nonce
+
+# The error behind the ExchangeException raised for requests to an exchange whose circuit is open.
+class CircuitOpenError(Exception):
+    pass
+
+# Tracks whether an exchange's API is healthy. After 'failure_threshold' requests in a row failed,
+# the circuit opens: requests fail right away, without being sent, for 'base_delay' seconds. Then
+# a single probe request is let through. If it succeeds the circuit closes again; if it fails the
+# circuit stays open for twice as long as the last time, up to 'max_delay' seconds.
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=5, base_delay=5, max_delay=300):
+        self._failure_threshold = failure_threshold
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._failures = 0
+        self._delay = base_delay
+        self._open_until = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def SetFailureThreshold(self, failure_threshold):
+        self._failure_threshold = failure_threshold
+
+    def IsOpen(self):
+        return self._open_until is not None
+
+    # Raises an ExchangeException if no request to the exchange called 'name' should be sent now.
+    # Otherwise returns whether the request is the probe of an open circuit; its outcome must be
+    # passed to RecordSuccess or RecordFailure.
+    def Check(self, name):
+        with self._lock:
+            if self._open_until is None:
+                return False
+            now = time.time()
+            if now >= self._open_until and not self._probing:
+                self._probing = True
+                return True
+            retry_delay = max(0, self._open_until - now)
+        raise ExchangeException(CircuitOpenError(
+            '%s is failing, retrying in %ds.' % (name, retry_delay)))
+
+    def RecordSuccess(self):
+        with self._lock:
+            self._failures = 0
+            self._delay = self._base_delay
+            self._open_until = None
+            self._probing = False
+
+    # Lets another request probe the open circuit, when the probe ended without telling whether
+    # the exchange is healthy.
+    def CancelProbe(self):
+        with self._lock:
+            self._probing = False
+
+    # Records a failed request, the probe if 'probe' is set. Returns whether the circuit opened.
+    def RecordFailure(self, probe):
+        with self._lock:
+            self._failures += 1
+            if probe:
+                self._probing = False
+                self._delay = min(self._delay * 2, self._max_delay)
+            elif self._open_until is not None or self._failures < self._failure_threshold:
+                return False
+            self._open_until = time.time() + self._delay
+            return True
+
+# Calls 'request', a function taking a timeout in seconds, and returns its result. If it didn't
+# return within 'hedge_delay' seconds, it's called again on another thread (after calling
+# 'before_hedge' there, if given) and the first successful result is returned. Raises an
+# ExchangeException if no call succeeded within 'deadline' seconds. Any other exception a call
+# raises is raised right away. The slower call is left to finish in the background, so 'request'
+# must be idempotent.
+def HedgedCall(request, hedge_delay, deadline, before_hedge=None):
+    results = queue.Queue()
+    end = time.time() + deadline
+
+    def Attempt(hedge):
+        try:
+            if hedge and before_hedge is not None:
+                before_hedge()
+            results.put((True, request(max(0.001, end - time.time()))))
+        except Exception as e:
+            # Passed to the calling thread, which raises it.
+            results.put((False, e))
+
+    pending = 0
+    hedged = False
+    for hedge in (False, True):
+        thread = threading.Thread(target=Attempt, args=(hedge,))
+        thread.daemon = True
+        thread.start()
+        pending += 1
+        while pending:
+            wait = end - time.time()
+            if not hedge:
+                wait = min(wait, hedge_delay)
+            try:
+                (succeeded, result) = results.get(timeout=max(0, wait))
+            except queue.Empty:
+                break
+            pending -= 1
+            if succeeded:
+                return result
+            if not isinstance(result, ExchangeException):
+                raise result  # a bug rather than a failed request
+            error = result
+        if not pending:
+            raise error
+        if time.time() >= end:
+            break
+    raise ExchangeException(socket.timeout('No response within %gs.' % deadline))